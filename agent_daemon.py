@@ -0,0 +1,191 @@
+# -----------------------------
+# agent_daemon.py
+# -----------------------------
+# Long-running agent daemon over a Unix socket.
+#
+# `python3 talk2mcp.py` pays for dotenv, the Gemini client, spawning both MCP
+# servers, listing tools and building the system prompt on every run. The
+# daemon does all of that once and then serves queries from many concurrent
+# clients, each with its own isolated query state, streaming progress events
+# back as they happen.
+#
+# Usage:
+#   python3 agent_daemon.py serve                 # start the daemon
+#   python3 agent_daemon.py ask "Calculate ASCII sum for HELLO"
+#
+# Protocol: newline-delimited JSON. A client sends
+#   {"id": "<request id>", "query": "<text>", "priority": "interactive" | "batch"}
+# ("priority" is optional and defaults to interactive; it picks the LLM rate
+# limiter lane) and receives {"id": ..., "event": ..., ...} lines for that
+# request, ending with an "end" event. A connection may send several requests;
+# they run concurrently.
+import argparse
+import json
+import os
+import socket
+import sys
+
+from packed_arrays import jsonable
+
+DEFAULT_SOCKET = os.getenv("MCP_AGENT_SOCKET", "/tmp/mcp_agent.sock")
+
+
+# -----------------------------
+# Daemon
+# -----------------------------
+async def serve(socket_path: str, max_concurrent: int):
+    import asyncio
+    from contextlib import AsyncExitStack
+    import talk2mcp
+    import profiling
+
+    # MCP_PROFILE=... profiles the whole daemon; kill -USR1 <pid> toggles it
+    profiling.start_from_env("daemon")
+    profiling.install_toggle_signal("daemon")
+
+    limit = asyncio.Semaphore(max_concurrent)
+    session_ids = iter(range(1, sys.maxsize))
+
+    async def handle_client(reader, writer):
+        session_id = next(session_ids)
+        print(f"DAEMON: session {session_id} connected")
+        tasks = set()
+
+        def send(message):
+            if not writer.is_closing():
+                writer.write(json.dumps(message, default=jsonable).encode() + b"\n")
+
+        async def run_request(request_id, query, priority):
+            def emit(event, **data):
+                send({"id": request_id, "event": event, **data})
+
+            async with limit:
+                try:
+                    await talk2mcp.run_query(query, emit=emit, query_id=str(request_id),
+                                             priority=priority)
+                except Exception as e:
+                    emit("error", message=f"{type(e).__name__}: {e}")
+            emit("end")
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    query = request["query"].strip()
+                    priority = request.get("priority", "interactive")
+                    if priority not in ("interactive", "batch"):
+                        raise ValueError(priority)
+                except (ValueError, KeyError, AttributeError):
+                    send({"event": "error",
+                          "message": "expected {\"id\": ..., \"query\": ..., \"priority\": \"interactive\"|\"batch\"}"})
+                    continue
+                request_id = request.get("id", f"{session_id}-{len(tasks) + 1}")
+                print(f"DAEMON: session {session_id} query {request_id}: {query}")
+                task = asyncio.create_task(run_request(request_id, query, priority))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            # Client finished sending; let its queries complete before closing
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        except (ConnectionResetError, BrokenPipeError):
+            for task in tasks:
+                task.cancel()
+        finally:
+            print(f"DAEMON: session {session_id} closed")
+            writer.close()
+
+    async with AsyncExitStack() as stack:
+        await talk2mcp.start_servers(stack)
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = await asyncio.start_unix_server(handle_client, path=socket_path)
+        os.chmod(socket_path, 0o600)
+        print(f"DAEMON: ready on {socket_path} (max {max_concurrent} concurrent queries)")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+
+# -----------------------------
+# Thin CLI client
+# -----------------------------
+def ask(socket_path: str, query: str, verbose: bool, priority: str = "interactive") -> int:
+    """Send one query to the daemon and print its progress; returns exit code"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print(f"❌ No agent daemon on {socket_path}. Start one with: python3 agent_daemon.py serve")
+        return 2
+
+    request_id = f"cli-{os.getpid()}"
+    sock.sendall(json.dumps({"id": request_id, "query": query, "priority": priority}).encode() + b"\n")
+    sock.shutdown(socket.SHUT_WR)
+
+    final_answer = None
+    with sock, sock.makefile("r") as stream:
+        for line in stream:
+            message = json.loads(line)
+            event = message.get("event")
+            if event == "tool_call":
+                print(f"→ {message['tool']}({message['arguments']})")
+            elif event == "tool_result" and verbose:
+                print(f"← {message['result']}")
+            elif event == "queued":
+                print(f"📤 {message['tool']} queued for background delivery")
+            elif event == "error":
+                print(f"⚠️  {message['message']}")
+            elif event == "report":
+                text = message.get("text") or "\n  ".join(message.get("lines", []))
+                print(f"{message['name']}: {text}")
+            elif event == "llm_response" and verbose:
+                print(f"LLM: {message['text']}")
+            elif event == "final_answer":
+                final_answer = message["text"]
+            elif event == "end":
+                break
+
+    if final_answer is None:
+        print("❌ No final answer")
+        return 1
+    print(f"✅ {final_answer}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm agent daemon and thin client")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Unix socket path")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = sub.add_parser("serve", help="Start the daemon")
+    serve_parser.add_argument("--max-concurrent", type=int, default=8,
+                              help="Queries processed at the same time")
+
+    ask_parser = sub.add_parser("ask", help="Send a query to a running daemon")
+    ask_parser.add_argument("query", nargs="+")
+    ask_parser.add_argument("-v", "--verbose", action="store_true",
+                            help="Also show LLM responses and tool results")
+    ask_parser.add_argument("--priority", choices=["interactive", "batch"], default="interactive",
+                            help="Rate limiter lane for this query's LLM calls")
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        import asyncio
+        try:
+            asyncio.run(serve(args.socket, args.max_concurrent))
+        except KeyboardInterrupt:
+            print("\nDAEMON: stopped")
+    else:
+        sys.exit(ask(args.socket, " ".join(args.query), args.verbose, args.priority))
+
+
+if __name__ == "__main__":
+    main()
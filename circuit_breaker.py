@@ -0,0 +1,136 @@
+# -----------------------------
+# circuit_breaker.py
+# -----------------------------
+# Tool-call timeouts and per-server circuit breakers.
+#
+# A hung tool (a stuck canvas automation, a Gmail API call that never returns)
+# used to freeze its query, and with shared sessions every other query too.
+# talk2mcp.call_tool now gives every call a timeout (per tool, falling back to
+# a per-server default). When it expires, the server is sent an MCP
+# notifications/cancelled for that request.
+#
+# Each server also has a CircuitBreaker:
+#   closed     calls go through; `failure_threshold` failures in a row trip it
+#   open       calls fail fast with CircuitOpenError for `reset_timeout` seconds
+#   half_open  one probe call is let through; success closes the breaker,
+#              failure opens it again
+# Timeouts and transport/protocol errors count as failures. A result with
+# isError set does not, since the server answered.
+import os
+import time
+from typing import Optional
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a server whose breaker is open"""
+
+
+class ToolTimeoutError(Exception):
+    """A tool call exceeded its timeout and was cancelled"""
+
+
+def parse_timeouts(text: Optional[str]) -> dict[str, float]:
+    """Per-tool timeouts from "send-email=90, open_canvas=20" text"""
+    timeouts = {}
+    for item in (text or "").split(","):
+        if not item.strip():
+            continue
+        name, sep, seconds = item.partition("=")
+        if not sep:
+            raise ValueError(f"expected tool=seconds, got '{item.strip()}'")
+        timeouts[name.strip()] = float(seconds)
+    return timeouts
+
+
+# Per-server default timeouts and per-tool overrides (seconds)
+SERVER_TIMEOUTS = {
+    "math": float(os.getenv("MCP_MATH_TIMEOUT", "30")),
+    "gmail": float(os.getenv("MCP_GMAIL_TIMEOUT", "60")),
+}
+TOOL_TIMEOUTS = {
+    "open_canvas": 20.0,
+    "refresh_canvas": 20.0,
+    **parse_timeouts(os.getenv("MCP_TOOL_TIMEOUTS")),
+}
+
+
+def call_timeout(server: str, tool: str) -> float:
+    return TOOL_TIMEOUTS.get(tool, SERVER_TIMEOUTS.get(server, 30.0))
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker for one MCP server"""
+
+    def __init__(self, name: str, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        # Metrics
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.trips = 0
+
+    def before_call(self):
+        """Admit a call or raise CircuitOpenError"""
+        if self.state == OPEN:
+            remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+            if remaining > 0:
+                self.rejected += 1
+                raise CircuitOpenError(
+                    f"{self.name} server circuit is open after {self.consecutive_failures} failures; "
+                    f"retrying in {remaining:.1f}s"
+                )
+            self.state = HALF_OPEN
+            print(f"DEBUG: {self.name} circuit half-open, probing")
+        if self.state == HALF_OPEN:
+            if self._probe_in_flight:
+                self.rejected += 1
+                raise CircuitOpenError(f"{self.name} server circuit is half-open; probe in progress")
+            self._probe_in_flight = True
+        self.calls += 1
+
+    def record_success(self):
+        if self.state == HALF_OPEN:
+            print(f"DEBUG: {self.name} circuit closed")
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self, timeout: bool = False):
+        self.failures += 1
+        self.timeouts += timeout
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.trips += 1
+                print(f"DEBUG: {self.name} circuit opened after {self.consecutive_failures} failures")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def record_cancelled(self):
+        """The caller gave up (e.g. discarded speculation); no verdict either way"""
+        self._probe_in_flight = False
+
+    def metrics(self) -> dict:
+        return {
+            "state": self.state,
+            "calls": self.calls,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "trips": self.trips,
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+    def report(self) -> str:
+        return (f"{self.name}: {self.state}, {self.calls} calls, {self.failures} failures "
+                f"({self.timeouts} timeouts), {self.rejected} rejected, {self.trips} trips")
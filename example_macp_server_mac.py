@@ -3,11 +3,12 @@
 # -----------------------------
 import asyncio
 import uvloop
-import sys
 import time
 import subprocess
 import os
 import math
+import json
+import argparse
 from PIL import Image as PILImage, ImageDraw, ImageFont
 import pyautogui
 
@@ -16,6 +17,11 @@ from mcp.server.fastmcp.prompts import base
 from mcp.types import TextContent
 from mcp import types
 
+import packed_arrays
+from packed_arrays import maybe_pack, unpack_arguments, unpack_text
+import profiling
+import safe_eval
+
 # -----------------------------
 # Setup uvloop for async performance
 # -----------------------------
@@ -24,7 +30,26 @@ asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 # -----------------------------
 # Instantiate MCP
 # -----------------------------
-mcp = FastMCP("Calculator")
+class CalculatorMCP(FastMCP):
+    """FastMCP that accepts packed numeric list arguments (see packed_arrays.py)
+    and labels its profile by the client's query id (sent in the request _meta)"""
+
+    async def call_tool(self, name, arguments, *args, **kwargs):
+        arguments = unpack_arguments(arguments)
+        query_id = self._query_id()
+        if query_id is None:
+            return await super().call_tool(name, arguments, *args, **kwargs)
+        with profiling.labelled(f"query-{query_id}"):
+            return await super().call_tool(name, arguments, *args, **kwargs)
+
+    def _query_id(self):
+        try:
+            meta = self.get_context().request_context.meta
+        except (LookupError, ValueError):  # not inside a request
+            return None
+        return getattr(meta, "query_id", None) if meta is not None else None
+
+mcp = CalculatorMCP("Calculator")
 
 # -----------------------------
 # Global variables for canvas
@@ -32,6 +57,20 @@ mcp = FastMCP("Calculator")
 canvas_image_path = "/tmp/mcp_canvas.png"
 canvas_app_open = False
 canvas_position = (100, 100)  # top-left of canvas window
+# Headless mode draws into the image file but never opens Preview
+# (used by load tests and CI)
+canvas_headless = False
+
+def configure_from_env():
+    """Read environment-driven settings; fork_server.py calls this again in
+    each forked child, whose environment differs from the template's"""
+    global canvas_image_path, canvas_headless
+    canvas_image_path = os.getenv("MCP_CANVAS_PATH", "/tmp/mcp_canvas.png")
+    canvas_headless = os.getenv("MCP_CANVAS_HEADLESS") == "1"
+    packed_arrays.PACK_THRESHOLD = int(os.getenv("MCP_PACK_THRESHOLD", "256"))
+    profiling.DEFAULT_DIR = os.getenv("MCP_PROFILE_DIR", "profiles")
+
+configure_from_env()
 
 # -----------------------------
 # Math / string / image tools
@@ -119,9 +158,9 @@ def create_thumbnail(image_path: str) -> Image:
     return Image(data=img.tobytes(), format="png")
 
 @mcp.tool()
-def strings_to_chars_to_int(string: str) -> list[int]:
+def strings_to_chars_to_int(string: str) -> list[int] | str:
     print("CALLED: strings_to_chars_to_int")
-    return [ord(c) for c in string]
+    return maybe_pack([ord(c) for c in string])
 
 @mcp.tool()
 def int_list_to_exponential_sum(int_list: list) -> float:
@@ -129,14 +168,114 @@ def int_list_to_exponential_sum(int_list: list) -> float:
     return sum(math.exp(i) for i in int_list)
 
 @mcp.tool()
-def fibonacci_numbers(n: int) -> list:
+def fibonacci_numbers(n: int) -> list | str:
     print("CALLED: fibonacci_numbers")
     if n <= 0:
         return []
     fib_sequence = [0, 1]
     for _ in range(2, n):
         fib_sequence.append(fib_sequence[-1] + fib_sequence[-2])
-    return fib_sequence[:n]
+    return maybe_pack(fib_sequence[:n])
+
+@mcp.tool()
+def evaluate(expression: str, variables: str = "") -> int | float:
+    """Evaluate a whole arithmetic expression in one call, e.g. "(a+b)*c - sqrt(d)".
+    Supports + - * / // % ** (or ^), pi, e and sqrt, cbrt, exp, log, log10, sin, cos, tan,
+    factorial, fibonacci, abs, round, floor, ceil, min, max, pow, remainder.
+    variables binds names to earlier results, e.g. "a=3, b=4.5"."""
+    print("CALLED: evaluate")
+    return safe_eval.evaluate(expression, variables)
+
+# -----------------------------
+# Batch calls
+# -----------------------------
+MAX_BATCH_CALLS = 100
+
+def _plain_result(value):
+    """Make a tool's return value usable as a reference and JSON-serialisable"""
+    if isinstance(value, str):
+        values = unpack_text(value)
+        return values.tolist() if values is not None else value
+    if isinstance(value, dict) and isinstance(value.get("content"), list):
+        # Canvas tools return {"content": [TextContent, ...]}
+        return " ".join(getattr(item, "text", str(item)) for item in value["content"])
+    if isinstance(value, Image):
+        return "<image>"
+    return value
+
+def _is_reference(value):
+    return isinstance(value, str) and value.startswith("$") and value[1:].isdigit()
+
+def _references(value):
+    """Indices of the earlier entries an argument value refers to"""
+    if _is_reference(value):
+        return {int(value[1:])}
+    if isinstance(value, list):
+        return set().union(*map(_references, value))
+    if isinstance(value, dict):
+        return set().union(*map(_references, value.values()))
+    return set()
+
+def _resolve_references(value, index, results):
+    """Replace "$N" strings with the result of earlier entry N"""
+    if _is_reference(value):
+        ref = int(value[1:])
+        if ref >= index:
+            raise ValueError(f"entry {index} can only reference earlier entries, not ${ref}")
+        if "error" in results[ref]:
+            raise ValueError(f"depends on failed entry {ref}")
+        return results[ref]["result"]
+    if isinstance(value, list):
+        return [_resolve_references(v, index, results) for v in value]
+    if isinstance(value, dict):
+        return {k: _resolve_references(v, index, results) for k, v in value.items()}
+    return value
+
+@mcp.tool()
+async def call_many(calls: str, mode: str = "sequential") -> list:
+    """Run several tool calls in one round trip.
+    calls is a JSON array of {"tool": name, "arguments": {...}} entries. An argument value "$N"
+    is replaced by the result of entry N (0-based, earlier entries only).
+    mode is "sequential" (in order) or "concurrent" (entries that reference others wait for them).
+    Returns one {"index", "tool", "result"} or {"index", "tool", "error"} per entry."""
+    print("CALLED: call_many")
+    entries = json.loads(calls) if isinstance(calls, str) else calls
+    if not isinstance(entries, list):
+        raise ValueError("calls must be a JSON array of {\"tool\": ..., \"arguments\": {...}}")
+    if len(entries) > MAX_BATCH_CALLS:
+        raise ValueError(f"at most {MAX_BATCH_CALLS} calls per batch")
+    if mode not in ("sequential", "concurrent"):
+        raise ValueError(f"mode must be 'sequential' or 'concurrent', not '{mode}'")
+
+    results = [None] * len(entries)
+    done = [asyncio.Event() for _ in entries]
+
+    async def run(index, entry):
+        tool = entry.get("tool") if isinstance(entry, dict) else None
+        try:
+            if not tool:
+                raise ValueError("entry needs a \"tool\" name")
+            if tool == "call_many":
+                raise ValueError("call_many cannot be nested")
+            arguments = entry.get("arguments") or {}
+            # Wait only for the entries this one references
+            for ref in _references(arguments):
+                if ref < index:
+                    await done[ref].wait()
+            arguments = unpack_arguments(_resolve_references(arguments, index, results))
+            value = await mcp._tool_manager.call_tool(tool, arguments)
+            results[index] = {"index": index, "tool": tool, "result": _plain_result(value)}
+        except Exception as e:
+            results[index] = {"index": index, "tool": tool, "error": f"{type(e).__name__}: {e}"}
+        finally:
+            done[index].set()
+
+    if mode == "sequential":
+        for index, entry in enumerate(entries):
+            await run(index, entry)
+    else:
+        await asyncio.gather(*(run(index, entry) for index, entry in enumerate(entries)))
+    return results
 
 # -----------------------------
 # Canvas tools (interactive)
@@ -157,8 +296,9 @@ async def open_canvas() -> dict:
     try:
         blank = PILImage.new("RGB", (800, 600), color="white")
         blank.save(canvas_image_path)
-        subprocess.Popen(["open", canvas_image_path])
-        time.sleep(1)
+        if not canvas_headless:
+            subprocess.Popen(["open", canvas_image_path])
+            time.sleep(1)
         canvas_app_open = True
         return {"content": [TextContent(type="text", text="Interactive canvas opened")]}
     except Exception as e:
@@ -226,7 +366,8 @@ async def refresh_canvas() -> dict:
             return {"content": [TextContent(type="text", text="Canvas not open")]}
 
         # Use helper to force Preview refresh
-        _force_preview_refresh(canvas_image_path)
+        if not canvas_headless:
+            _force_preview_refresh(canvas_image_path)
         
         return {"content": [TextContent(type="text", text="Canvas refreshed and displayed in Preview")]}
     except Exception as e:
@@ -259,8 +400,23 @@ def debug_error(error: str) -> list[base.Message]:
 # RUN MCP SERVER
 # -----------------------------
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calculator MCP server")
+    parser.add_argument("mode", nargs="?", choices=["dev", "http", "stdio"], default="stdio")
+    parser.add_argument("--profile", nargs="?", const="sampling", choices=["sampling", "cprofile"],
+                        help="Profile this server process (also enabled by MCP_PROFILE)")
+    parser.add_argument("--profile-dir", default=profiling.DEFAULT_DIR)
+    args = parser.parse_args()
+    if args.profile:
+        profiling.start(args.profile, args.profile_dir, "server")
+    else:
+        profiling.start_from_env("server")
+    # kill -USR1 <pid> starts/stops profiling without a restart
+    profiling.install_toggle_signal("server")
+
     print("STARTING MCP SERVER ON TCP 8765 WITH UVLOOP")
-    if len(sys.argv) > 1 and sys.argv[1] == "dev":
+    if args.mode == "dev":
         mcp.run(transport="tcp")  # Run without transport for dev server
+    elif args.mode == "http":
+        mcp.run(transport="streamable-http")  # Serve over HTTP (default http://127.0.0.1:8000/mcp)
     else:
         mcp.run(transport="stdio")  # Run with stdio for direct execution
@@ -0,0 +1,355 @@
+# -----------------------------
+# fork_server.py
+# -----------------------------
+# Pre-forked warm template for the Math MCP server.
+#
+# Cold-starting example_macp_server_mac.py means a fresh interpreter importing
+# mcp, PIL, pyautogui, uvloop, ... and registering every tool before the
+# first request. That cost comes back on every restart, every worker_pool.py
+# worker and every new session.
+#
+# The fork server pays it once. The template process imports the server
+# module, which registers the tools, and then waits on a Unix socket. Each
+# connection is one stdio session. The template forks a child, the child
+# makes the connection its stdin/stdout and runs the FastMCP stdio server.
+# Children share the template's memory pages copy-on-write.
+#
+# Protocol: the client first sends one JSON line {"env": {...}} with the
+# settings a spawned server would have been given (packed arrays, profiling,
+# ...). It then speaks MCP JSON-RPC over the socket exactly as over stdio.
+# {"ping": true} just checks that the template is up.
+#
+# talk2mcp.py uses it when MCP_FORK_SERVER=<socket path> is set. It starts the
+# template on first use and falls back to a cold start if it can't connect.
+#
+#   python3 fork_server.py [--socket PATH] serve
+#   python3 fork_server.py bench --sessions 8       # fork vs cold start
+import argparse
+import io
+import json
+import os
+import signal
+import socket
+import sys
+import time
+from contextlib import asynccontextmanager, suppress
+
+DEFAULT_SOCKET = os.getenv("MCP_FORK_SERVER") or "/tmp/mcp_math_fork.sock"
+SERVER_MODULE = "example_macp_server_mac"
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), f"{SERVER_MODULE}.py")
+MAX_HEADER = 64 * 1024
+
+
+# -----------------------------
+# Template process
+# -----------------------------
+def _read_header(conn) -> dict:
+    """Read the one-line JSON header without consuming any MCP bytes"""
+    data = bytearray()
+    while not data.endswith(b"\n"):
+        chunk = conn.recv(1)
+        if not chunk:
+            raise ConnectionError("connection closed before header")
+        data += chunk
+        if len(data) > MAX_HEADER:
+            raise ValueError("header too long")
+    return json.loads(data)
+
+
+def _run_child(conn, listener, server, env):
+    """In the forked child: serve one MCP stdio session over `conn`"""
+    import profiling
+    status = 0
+    try:
+        listener.close()
+        for signum in (signal.SIGCHLD, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, signal.SIG_DFL)
+        os.environ.update(env)
+        server.configure_from_env()
+        sys.stdout.flush()
+        os.dup2(conn.fileno(), 0)
+        os.dup2(conn.fileno(), 1)
+        conn.close()
+        # The inherited sys.stdin/sys.stdout still wrap the template's streams
+        # (stdout may be a seekable log file); give the session fresh ones on fd 0/1
+        sys.stdin = io.TextIOWrapper(open(0, "rb", closefd=False), encoding="utf-8")
+        sys.stdout = io.TextIOWrapper(open(1, "wb", closefd=False), encoding="utf-8",
+                                      line_buffering=True)
+        profiling.start_from_env("server")
+        profiling.install_toggle_signal("server")
+        server.mcp.run(transport="stdio")
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+        status = 1
+    finally:
+        # FastMCP closes the stdout buffer on teardown, so flushing may raise;
+        # nothing may stop os._exit, or the child falls back into serve()
+        for cleanup in (profiling.stop, sys.stdout.flush, sys.stderr.flush):
+            with suppress(Exception):
+                cleanup()
+        # Never fall back into the template's accept loop
+        os._exit(status)
+
+
+def serve(socket_path: str):
+    import importlib
+    sys.path.insert(0, os.path.dirname(SERVER_SCRIPT))
+    started = time.perf_counter()
+    server = importlib.import_module(SERVER_MODULE)
+    print(f"FORK SERVER: template ready in {time.perf_counter() - started:.2f}s "
+          f"({len(server.mcp._tool_manager.list_tools())} tools, pid {os.getpid()})", file=sys.stderr)
+
+    # Children are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    template_pid = os.getpid()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    os.chmod(socket_path, 0o600)
+    listener.listen(64)
+    with open(socket_path + ".pid", "w") as f:
+        f.write(str(os.getpid()))
+    print(f"FORK SERVER: listening on {socket_path}", file=sys.stderr)
+
+    try:
+        while True:
+            conn, _ = listener.accept()
+            try:
+                conn.settimeout(5)
+                header = _read_header(conn)
+                conn.settimeout(None)
+            except (OSError, ValueError) as e:
+                print(f"FORK SERVER: bad connection: {e}", file=sys.stderr)
+                conn.close()
+                continue
+            if header.get("ping"):
+                conn.sendall(b"pong\n")
+                conn.close()
+                continue
+            sys.stdout.flush()
+            sys.stderr.flush()
+            if os.fork() == 0:
+                _run_child(conn, listener, server, header.get("env") or {})
+            conn.close()
+    finally:
+        listener.close()
+        # Only the template owns the socket; a child unwinding here must not remove it
+        if os.getpid() == template_pid:
+            for path in (socket_path, socket_path + ".pid"):
+                if os.path.exists(path):
+                    os.unlink(path)
+
+
+# -----------------------------
+# Client side
+# -----------------------------
+def is_running(socket_path: str) -> bool:
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(2)
+            sock.connect(socket_path)
+            sock.sendall(b'{"ping": true}\n')
+            return sock.recv(5) == b"pong\n"
+    except OSError:
+        return False
+
+
+def ensure_running(socket_path: str = DEFAULT_SOCKET, timeout: float = 60.0) -> bool:
+    """Start the template in the background unless it is already up"""
+    if is_running(socket_path):
+        return True
+    import fcntl
+    import subprocess
+    # Several worker processes may race to start it; only one does
+    with open(socket_path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if is_running(socket_path):
+            return True
+        # macOS: Objective-C frameworks (pyautogui) must tolerate fork without exec
+        env = {**os.environ, "OBJC_DISABLE_INITIALIZE_FORK_SAFETY": "YES"}
+        with open(socket_path + ".log", "a") as log:
+            subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "--socket", socket_path, "serve"],
+                stdin=subprocess.DEVNULL, stdout=log, stderr=log, env=env,
+                cwd=os.path.dirname(SERVER_SCRIPT), start_new_session=True,
+            )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if is_running(socket_path):
+                return True
+            time.sleep(0.1)
+    return False
+
+
+@asynccontextmanager
+async def fork_client(socket_path: str = DEFAULT_SOCKET, env: dict | None = None):
+    """MCP transport to a forked server: yields (read_stream, write_stream)
+    for ClientSession, like mcp.client.stdio.stdio_client"""
+    import anyio
+    from mcp import types
+    try:
+        from mcp.shared.message import SessionMessage
+    except ImportError:  # older SDKs pass bare JSONRPCMessages
+        SessionMessage = None
+
+    stream = await anyio.connect_unix(socket_path)
+    await stream.send(json.dumps({"env": env or {}}).encode() + b"\n")
+    read_send, read_recv = anyio.create_memory_object_stream(0)
+    write_send, write_recv = anyio.create_memory_object_stream(0)
+
+    async def socket_reader():
+        buffer = b""
+        async with read_send:
+            while True:
+                try:
+                    chunk = await stream.receive()
+                except (anyio.EndOfStream, anyio.ClosedResourceError):
+                    return
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    if not line.strip():
+                        continue
+                    try:
+                        message = types.JSONRPCMessage.model_validate_json(line)
+                    except Exception as exc:
+                        # Stray prints on the server's stdout, as with stdio
+                        await read_send.send(exc)
+                        continue
+                    await read_send.send(SessionMessage(message) if SessionMessage else message)
+
+    async def socket_writer():
+        async with write_recv:
+            async for item in write_recv:
+                message = getattr(item, "message", item)
+                data = message.model_dump_json(by_alias=True, exclude_none=True)
+                await stream.send(data.encode() + b"\n")
+
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(socket_reader)
+        tg.start_soon(socket_writer)
+        try:
+            yield read_recv, write_send
+        finally:
+            await stream.aclose()
+            tg.cancel_scope.cancel()
+
+
+# -----------------------------
+# Benchmark
+# -----------------------------
+def _memory(pid: int) -> dict | None:
+    """RSS / PSS / shared kB of a process (Linux smaps_rollup)"""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            fields = {line.split(":")[0]: int(line.split()[1]) for line in f if line.endswith("kB\n")}
+    except OSError:
+        return None
+    return {
+        "rss_kb": fields.get("Rss", 0),
+        "pss_kb": fields.get("Pss", 0),
+        "shared_kb": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+    }
+
+
+def _children(ppid: int) -> list[int]:
+    pids = []
+    for entry in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    if int(f.read().rsplit(")", 1)[1].split()[1]) == ppid:
+                        pids.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                pass
+    return pids
+
+
+async def _bench_mode(name, open_transport, sessions, parent_pid):
+    from contextlib import AsyncExitStack
+    from mcp import ClientSession
+    from mcp_loadgen import percentile
+
+    latencies = []
+    async with AsyncExitStack() as stack:
+        # Keep every session open so their memory can be measured together
+        for _ in range(sessions):
+            started = time.perf_counter()
+            read, write = await stack.enter_async_context(open_transport())
+            session = await stack.enter_async_context(ClientSession(read, write))
+            await session.initialize()
+            await session.call_tool("add", arguments={"a": 1, "b": 2})
+            latencies.append(time.perf_counter() - started)
+        memory = [m for m in map(_memory, _children(parent_pid)) if m]
+
+    latencies.sort()
+    result = {
+        "sessions": sessions,
+        "spawn_p50_ms": percentile(latencies, 50) * 1000,
+        "spawn_max_ms": latencies[-1] * 1000,
+    }
+    if memory:
+        for key in ("rss_kb", "pss_kb", "shared_kb"):
+            result[f"avg_{key}"] = sum(m[key] for m in memory) / len(memory)
+    print(f"{name:<6} spawn-to-first-result p50 {result['spawn_p50_ms']:8.1f}ms  "
+          f"max {result['spawn_max_ms']:8.1f}ms", end="")
+    if memory:
+        print(f"  per server: RSS {result['avg_rss_kb'] / 1024:.1f}MB  "
+              f"PSS {result['avg_pss_kb'] / 1024:.1f}MB  shared {result['avg_shared_kb'] / 1024:.1f}MB")
+    else:
+        print("  (memory: /proc not available)")
+    return result
+
+
+async def bench(socket_path: str, sessions: int, save: str | None):
+    from mcp import StdioServerParameters
+    from mcp.client.stdio import stdio_client, get_default_environment
+
+    env = {"MCP_CANVAS_HEADLESS": "1"}
+    cold_params = StdioServerParameters(command=sys.executable, args=[SERVER_SCRIPT],
+                                        env={**get_default_environment(), **env})
+    cold = await _bench_mode("cold", lambda: stdio_client(cold_params), sessions, os.getpid())
+
+    if not ensure_running(socket_path):
+        print(f"❌ Could not start the fork server on {socket_path}")
+        return
+    with open(socket_path + ".pid") as f:
+        template_pid = int(f.read())
+    forked = await _bench_mode("fork", lambda: fork_client(socket_path, env), sessions, template_pid)
+    template = _memory(template_pid)
+
+    print(f"Speedup: {cold['spawn_p50_ms'] / forked['spawn_p50_ms']:.1f}x faster spawn (p50)")
+    if template:
+        print(f"Template: RSS {template['rss_kb'] / 1024:.1f}MB (paid once, shared copy-on-write)")
+    if save:
+        with open(save, "w") as f:
+            json.dump({"cold": cold, "fork": forked, "template": template}, f, indent=2)
+        print(f"Saved results to {save}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-forked warm template for the Math MCP server")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Unix socket path")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("serve", help="Run the template process")
+    bench_parser = sub.add_parser("bench", help="Compare fork and cold-start spawn latency and memory")
+    bench_parser.add_argument("--sessions", type=int, default=8)
+    bench_parser.add_argument("--save", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        try:
+            serve(args.socket)
+        except KeyboardInterrupt:
+            pass
+    else:
+        import asyncio
+        asyncio.run(bench(args.socket, args.sessions, args.save))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# -----------------------------
+# local_backend.py
+# -----------------------------
+# Local stand-in for the Gemini client.
+#
+# Lets the agent run end to end without an API key or network: it exposes the
+# same `client.models.generate_content(model=..., contents=..., config=...)`
+# call and answers with the text protocol (FUNCTION_CALL: / FINAL_ANSWER:),
+# planning the usual ASCII / Fibonacci / canvas / email workflows from the
+# query and the iteration history in the prompt.
+#
+# Select it with LLM_BACKEND=local. LOCAL_LLM_LATENCY (seconds) adds a fixed
+# delay per call to mimic a remote model.
+#
+# To exercise rate limiting it can also inject throttling, answering with a
+# 429 RESOURCE_EXHAUSTED error like the real API:
+#   LOCAL_LLM_RPM             calls allowed per rolling minute (0 = unlimited)
+#   LOCAL_LLM_MAX_CONCURRENT  calls allowed in flight at once (0 = unlimited)
+#   LOCAL_LLM_THROTTLE_RATE   probability of a random 429 on any call
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+
+_HISTORY_RE = re.compile(
+    r"In the \d+ iteration you called (?P<tool>[\w-]+) with .*? parameters, "
+    r"and (?:the function returned (?P<result>.*?)|it was queued for background delivery)\.(?=\s|$)",
+    re.DOTALL,
+)
+
+
+class LocalResponse:
+    """Minimal stand-in for a genai GenerateContentResponse"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.function_calls = None
+
+
+class LocalThrottleError(Exception):
+    """Injected quota error, shaped like google.genai's ClientError"""
+
+    code = 429
+    status = "RESOURCE_EXHAUSTED"
+
+    def __init__(self, reason: str):
+        super().__init__(f"429 RESOURCE_EXHAUSTED. {{'error': {{'code': 429, 'message': '{reason}'}}}}")
+
+
+class LocalStandInClient:
+    """Rule-based planner that speaks the text function-calling protocol"""
+
+    def __init__(self, latency: float = None, rpm: int = None, max_concurrent: int = None,
+                 throttle_rate: float = None):
+        self.latency = float(os.getenv("LOCAL_LLM_LATENCY", "0")) if latency is None else latency
+        self.rpm = int(os.getenv("LOCAL_LLM_RPM", "0")) if rpm is None else rpm
+        self.max_concurrent = (int(os.getenv("LOCAL_LLM_MAX_CONCURRENT", "0"))
+                               if max_concurrent is None else max_concurrent)
+        self.throttle_rate = (float(os.getenv("LOCAL_LLM_THROTTLE_RATE", "0"))
+                              if throttle_rate is None else throttle_rate)
+        self.calls = 0
+        self.throttled = 0
+        # generate_content runs in executor threads
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._recent = deque()
+
+    @property
+    def models(self):
+        return self
+
+    def _admit(self):
+        """Raise LocalThrottleError if this call would exceed the injected quota"""
+        with self._lock:
+            self.calls += 1
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.popleft()
+            reason = None
+            if self.rpm and len(self._recent) >= self.rpm:
+                reason = f"Quota exceeded: {self.rpm} requests per minute"
+            elif self.max_concurrent and self._in_flight >= self.max_concurrent:
+                reason = f"Too many concurrent requests (max {self.max_concurrent})"
+            elif self.throttle_rate and random.random() < self.throttle_rate:
+                reason = "Resource has been exhausted (injected)"
+            if reason:
+                self.throttled += 1
+                raise LocalThrottleError(reason)
+            self._recent.append(now)
+            self._in_flight += 1
+
+    def generate_content(self, model=None, contents="", config=None):
+        self._admit()
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            return LocalResponse(self.plan(contents if isinstance(contents, str) else str(contents)))
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def plan(self, prompt: str) -> str:
+        """Decide the next FUNCTION_CALL / FINAL_ANSWER line for a prompt"""
+        body = prompt.rsplit("\n\nQuery: ", 1)[-1]
+        query = body.split("\n\n", 1)[0]
+        lowered = query.lower()
+        done = {}
+        for m in _HISTORY_RE.finditer(body):
+            done[m.group("tool")] = (m.group("result") or "").strip("[] ")
+
+        # 1. Calculation
+        if "fibonacci" in lowered:
+            n = re.search(r"\d+", query)
+            if "fibonacci_numbers" not in done:
+                return f"FUNCTION_CALL: fibonacci_numbers|{n.group() if n else 10}"
+            values = done["fibonacci_numbers"]
+            if "sum" in lowered and "add_list" not in done:
+                return f"FUNCTION_CALL: add_list|{values}"
+            result = done.get("add_list", values)
+        else:
+            caps = [w for w in re.findall(r"\b[A-Z][A-Z0-9]+\b", query) if w != "ASCII"]
+            word = re.search(r"\b(?:for|in|of)\s+['\"]?([A-Za-z0-9]+)['\"]?", query)
+            word = caps[0] if caps else word.group(1) if word else query.split()[-1]
+            if "strings_to_chars_to_int" not in done:
+                return f"FUNCTION_CALL: strings_to_chars_to_int|{word}"
+            codes = done["strings_to_chars_to_int"]
+            reducer = "int_list_to_exponential_sum" if "exponential" in lowered else "add_list"
+            if reducer not in done:
+                return f"FUNCTION_CALL: {reducer}|{codes}"
+            result = done[reducer]
+
+        # 2. Visualization
+        if any(word in lowered for word in ("visualize", "visualise", "draw", "canvas", "paint")):
+            steps = [
+                ("open_canvas", "FUNCTION_CALL: open_canvas"),
+                ("draw_rectangle", "FUNCTION_CALL: draw_rectangle|100|100|600|200"),
+                ("add_text_in_paint", f"FUNCTION_CALL: add_text_in_paint|110|110|Result: {result}"),
+                ("refresh_canvas", "FUNCTION_CALL: refresh_canvas"),
+            ]
+            for tool, line in steps:
+                if tool not in done:
+                    return line
+
+        # 3. Email
+        email = re.search(r"[\w.+-]+@[\w-]+\.[\w.-]+", query)
+        if email and "send-email" not in done:
+            subject = re.search(r"subject\s+['\"]([^'\"]+)['\"]", query, re.IGNORECASE)
+            subject = subject.group(1) if subject else "Calculation Result"
+            return f"FUNCTION_CALL: send-email|{email.group().rstrip('.')}|{subject}|The result is: {result}"
+
+        return f"FINAL_ANSWER: [{result}]"
@@ -0,0 +1,108 @@
+# -----------------------------
+# loop_guard.py
+# -----------------------------
+# Loop and stall detection with adaptive iteration budgeting.
+#
+# Each wasted iteration costs a full LLM call: repeating a FUNCTION_CALL that
+# was already made, cycling between the same few calls, or answering in an
+# unexpected format. The LoopGuard answers repeats from the earlier result with
+# a corrective nudge instead of re-executing them, sizes the iteration budget
+# to the kind of query, and ends the query early when several iterations in a
+# row make no progress.
+import json
+from typing import Optional
+
+# Iterations a query class is expected to need, with a little headroom
+BASE_BUDGET = 6             # math only: a few tool calls + FINAL_ANSWER
+VISUALIZE_BUDGET = 5        # open_canvas -> draw_rectangle -> add_text_in_paint -> refresh_canvas
+EMAIL_BUDGET = 2            # send-email
+
+VISUALIZE_WORDS = ("visualize", "visualise", "draw", "canvas", "paint", "show on")
+EMAIL_WORDS = ("email", "e-mail", "mail to", "notify")
+
+FORMAT_NUDGE = ("Your last response was not in the required format. Respond with exactly one line "
+                "starting with FUNCTION_CALL: or FINAL_ANSWER:.")
+# Native function calling: tools are called through the API, not as text
+NATIVE_FORMAT_NUDGE = ("Your last response was not in the required format. Call exactly one of the "
+                       "provided functions, or respond with exactly one line starting with FINAL_ANSWER:.")
+
+
+def iteration_budget(query: str, max_iterations: int) -> int:
+    """Iteration budget for a query, based on what it asks for"""
+    text = query.lower()
+    budget = BASE_BUDGET
+    if any(word in text for word in VISUALIZE_WORDS):
+        budget += VISUALIZE_BUDGET
+    if any(word in text for word in EMAIL_WORDS):
+        budget += EMAIL_BUDGET
+    return min(budget, max_iterations)
+
+
+def _call_key(tool: str, arguments: dict) -> str:
+    return f"{tool}|{json.dumps(arguments, sort_keys=True, default=str)}"
+
+
+class LoopGuard:
+    """Tracks one query's calls and decides when iterations are being wasted"""
+
+    def __init__(self, query: str, max_iterations: int, max_stalled: int = 3, native: bool = False):
+        self.budget = iteration_budget(query, max_iterations)
+        self.format_nudge = NATIVE_FORMAT_NUDGE if native else FORMAT_NUDGE
+        self.max_stalled = max_stalled
+        self.history: list[str] = []
+        self.results: dict[str, tuple[int, str]] = {}
+        self.stalled = 0
+        self.repeats = 0
+        self.cycles = 0
+        self.bad_formats = 0
+
+    @property
+    def wasted(self) -> int:
+        return self.repeats + self.cycles + self.bad_formats
+
+    @property
+    def should_stop(self) -> bool:
+        """True once `max_stalled` iterations in a row made no progress"""
+        return self.stalled >= self.max_stalled
+
+    def check_repeat(self, tool: str, arguments: dict) -> Optional[str]:
+        """Return a corrective nudge if this exact call was already made"""
+        key = _call_key(tool, arguments)
+        if key not in self.results:
+            return None
+        self.history.append(key)
+        self.stalled += 1
+        iteration, result_str = self.results[key]
+        if self._is_cycle():
+            self.cycles += 1
+            kind = "You are going round in a loop of the same calls."
+        else:
+            self.repeats += 1
+            kind = "Do not repeat function calls with the same parameters."
+        return (f"You already called {tool} with {arguments} parameters in iteration {iteration} "
+                f"and it returned {result_str}. {kind} Use that result and move on to the next step "
+                f"or give the FINAL_ANSWER.")
+
+    def record(self, tool: str, arguments: dict, iteration: int, result_str: str):
+        """Record a call that was actually executed; this counts as progress"""
+        key = _call_key(tool, arguments)
+        self.history.append(key)
+        self.results[key] = (iteration, result_str)
+        self.stalled = 0
+
+    def unexpected_format(self) -> str:
+        self.bad_formats += 1
+        self.stalled += 1
+        return self.format_nudge
+
+    def _is_cycle(self) -> bool:
+        """Does the call history end in a repeating block of 2 or 3 calls?"""
+        for period in (2, 3):
+            tail = self.history[-2 * period:]
+            if len(tail) == 2 * period and tail[:period] == tail[period:] and len(set(tail[:period])) > 1:
+                return True
+        return False
+
+    def report(self, iterations: int) -> str:
+        return (f"{iterations}/{self.budget} iterations used, {self.wasted} wasted "
+                f"({self.repeats} repeats, {self.cycles} cycles, {self.bad_formats} bad formats)")
@@ -0,0 +1,356 @@
+# -----------------------------
+# mcp_loadgen.py
+# -----------------------------
+# Load generator and JSON-RPC record/replay harness for the MCP servers.
+#
+#   run     Open N concurrent client sessions (one stdio server each, or one
+#           HTTP server via --url) and drive a weighted mix of tools. Reports
+#           throughput and latency percentiles.
+#   proxy   Sit between an MCP client and a stdio server, forwarding traffic
+#           and recording every JSON-RPC message to a JSONL file. talk2mcp.py
+#           uses this when MCP_RECORD=<file> is set.
+#   replay  Re-issue the tools/call requests of a recording against a fresh
+#           server, at the recorded pace scaled by --speed (0 = flat out).
+#
+# `run` and `replay` can save their summary with --save and compare against a
+# previously saved one with --baseline.
+#
+# Examples:
+#   python3 mcp_loadgen.py run --sessions 8 --duration 20 --mix add=5,factorial=2,fibonacci_numbers=2,canvas=1
+#   python3 mcp_loadgen.py run --url http://127.0.0.1:8000/mcp --sessions 16
+#   MCP_RECORD=traffic.jsonl python3 talk2mcp.py
+#   python3 mcp_loadgen.py replay traffic.jsonl --speed 2 --baseline baseline.json
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "example_macp_server_mac.py")
+DEFAULT_MIX = "add=5,multiply=2,factorial=2,fibonacci_numbers=2,strings_to_chars_to_int=2,canvas=1"
+
+# Tool -> argument generator; "canvas" is a small drawing sequence
+ARGUMENT_GENERATORS = {
+    "add": lambda r: {"a": r.randint(0, 1000), "b": r.randint(0, 1000)},
+    "subtract": lambda r: {"a": r.randint(0, 1000), "b": r.randint(0, 1000)},
+    "multiply": lambda r: {"a": r.randint(0, 1000), "b": r.randint(0, 1000)},
+    "divide": lambda r: {"a": r.randint(0, 1000), "b": r.randint(1, 1000)},
+    "power": lambda r: {"a": r.randint(0, 20), "b": r.randint(0, 10)},
+    "sqrt": lambda r: {"a": r.randint(0, 10000)},
+    "factorial": lambda r: {"a": r.randint(0, 200)},
+    "log": lambda r: {"a": r.randint(1, 10000)},
+    "sin": lambda r: {"a": r.randint(0, 360)},
+    "cos": lambda r: {"a": r.randint(0, 360)},
+    "tan": lambda r: {"a": r.randint(0, 360)},
+    "fibonacci_numbers": lambda r: {"n": r.randint(1, 200)},
+    "strings_to_chars_to_int": lambda r: {"string": "".join(r.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for _ in range(10))},
+    "int_list_to_exponential_sum": lambda r: {"int_list": [r.randint(60, 90) for _ in range(10)]},
+    "add_list": lambda r: {"l": [r.randint(0, 1000) for _ in range(50)]},
+}
+
+CANVAS_SEQUENCE = [
+    ("open_canvas", lambda r: {}),
+    ("draw_rectangle", lambda r: {"x1": 100, "y1": 100, "x2": 600, "y2": 200}),
+    ("add_text_in_paint", lambda r: {"text_x": 110, "text_y": 110, "text": str(r.random())}),
+]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Stats:
+    """Latency samples and error counts per tool"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def add(self, tool, seconds, ok):
+        self.latencies[tool].append(seconds)
+        if not ok:
+            self.errors[tool] += 1
+
+    def summary(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        all_latencies = sorted(x for values in self.latencies.values() for x in values)
+        per_tool = {}
+        for tool, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            per_tool[tool] = {
+                "calls": len(values),
+                "errors": self.errors[tool],
+                "p50_ms": percentile(values, 50) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+            }
+        return {
+            "calls": len(all_latencies),
+            "errors": sum(self.errors.values()),
+            "elapsed_s": elapsed,
+            "throughput_rps": len(all_latencies) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(all_latencies, 50) * 1000,
+            "p90_ms": percentile(all_latencies, 90) * 1000,
+            "p99_ms": percentile(all_latencies, 99) * 1000,
+            "max_ms": (all_latencies[-1] * 1000) if all_latencies else 0.0,
+            "tools": per_tool,
+        }
+
+
+def print_summary(summary, baseline=None):
+    print("\n" + "=" * 70)
+    print(f"Calls: {summary['calls']}  Errors: {summary['errors']}  Elapsed: {summary['elapsed_s']:.2f}s")
+    for key, label in (("throughput_rps", "Throughput (req/s)"), ("p50_ms", "p50 (ms)"),
+                       ("p90_ms", "p90 (ms)"), ("p99_ms", "p99 (ms)"), ("max_ms", "max (ms)")):
+        line = f"{label:<20} {summary[key]:>10.2f}"
+        if baseline and baseline.get(key):
+            change = (summary[key] - baseline[key]) / baseline[key] * 100
+            line += f"   baseline {baseline[key]:>10.2f}  ({change:+.1f}%)"
+        print(line)
+    print("-" * 70)
+    for tool, info in summary["tools"].items():
+        print(f"  {tool:<30} {info['calls']:>7} calls {info['errors']:>4} errors "
+              f"p50 {info['p50_ms']:>8.2f}ms p99 {info['p99_ms']:>8.2f}ms")
+    print("=" * 70)
+
+
+def finish(summary, args):
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_summary(summary, baseline)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"Saved summary to {args.save}")
+
+
+# -----------------------------
+# Sessions
+# -----------------------------
+@asynccontextmanager
+async def open_session(url=None, server_env=None):
+    """MCP ClientSession over stdio (own server process) or HTTP (shared server)"""
+    from mcp import ClientSession, StdioServerParameters
+    from mcp.client.stdio import stdio_client, get_default_environment
+
+    if url:
+        try:
+            from mcp.client.streamable_http import streamablehttp_client
+            transport = streamablehttp_client(url)
+        except ImportError:
+            from mcp.client.sse import sse_client
+            transport = sse_client(url)
+        async with transport as streams:
+            async with ClientSession(streams[0], streams[1]) as session:
+                await session.initialize()
+                yield session
+        return
+
+    params = StdioServerParameters(
+        command=sys.executable,
+        args=[SERVER_SCRIPT],
+        env={**get_default_environment(), **(server_env or {})},
+    )
+    async with stdio_client(params) as (read, write):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            yield session
+
+
+async def timed_call(session, stats, tool, arguments):
+    start = time.perf_counter()
+    ok = True
+    try:
+        result = await session.call_tool(tool, arguments=arguments)
+        ok = not getattr(result, "isError", False)
+    except Exception:
+        ok = False
+    stats.add(tool, time.perf_counter() - start, ok)
+
+
+# -----------------------------
+# run
+# -----------------------------
+def parse_mix(mix):
+    weights = {}
+    for entry in mix.split(","):
+        name, _, weight = entry.partition("=")
+        name = name.strip()
+        if name != "canvas" and name not in ARGUMENT_GENERATORS:
+            raise SystemExit(f"Unknown tool in mix: {name}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+async def drive_session(index, args, weights, stats, deadline):
+    rng = random.Random(args.seed + index)
+    names = list(weights)
+    canvas_dir = tempfile.mkdtemp(prefix="mcp_loadgen_")
+    server_env = {
+        "MCP_CANVAS_HEADLESS": "1",
+        "MCP_CANVAS_PATH": os.path.join(canvas_dir, "canvas.png"),
+    }
+    async with open_session(args.url, server_env) as session:
+        async def worker():
+            calls = 0
+            while time.perf_counter() < deadline and (not args.requests or calls < args.requests):
+                name = rng.choices(names, weights=[weights[n] for n in names])[0]
+                if name == "canvas":
+                    for tool, make_args in CANVAS_SEQUENCE:
+                        await timed_call(session, stats, tool, make_args(rng))
+                        calls += 1
+                else:
+                    await timed_call(session, stats, name, ARGUMENT_GENERATORS[name](rng))
+                    calls += 1
+
+        await asyncio.gather(*(worker() for _ in range(args.inflight)))
+
+
+async def run(args):
+    weights = parse_mix(args.mix)
+    stats = Stats()
+    deadline = time.perf_counter() + args.duration
+    print(f"Driving {args.sessions} sessions x {args.inflight} in flight for {args.duration}s "
+          f"({'HTTP ' + args.url if args.url else 'stdio'}), mix: {args.mix}")
+    results = await asyncio.gather(
+        *(drive_session(i, args, weights, stats, deadline) for i in range(args.sessions)),
+        return_exceptions=True,
+    )
+    stats.finished = time.perf_counter()
+    for i, result in enumerate(results):
+        if isinstance(result, Exception):
+            print(f"Session {i} failed: {result}")
+    finish(stats.summary(), args)
+
+
+# -----------------------------
+# proxy (record)
+# -----------------------------
+def proxy(args):
+    """Forward stdio between client and server, logging JSON-RPC messages"""
+    if not args.command:
+        raise SystemExit("proxy needs a server command after --")
+    child = subprocess.Popen(args.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    log = open(args.out, "a", buffering=1)
+    lock = threading.Lock()
+    started = time.time()
+
+    def record(direction, line):
+        try:
+            message = json.loads(line)
+        except ValueError:
+            message = {"raw": line.decode(errors="replace").rstrip("\n")}
+        with lock:
+            log.write(json.dumps({"t": time.time() - started, "dir": direction, "msg": message}) + "\n")
+
+    def client_to_server():
+        for line in sys.stdin.buffer:
+            record("c2s", line)
+            child.stdin.write(line)
+            child.stdin.flush()
+        child.stdin.close()
+
+    threading.Thread(target=client_to_server, daemon=True).start()
+    for line in child.stdout:
+        record("s2c", line)
+        sys.stdout.buffer.write(line)
+        sys.stdout.buffer.flush()
+    sys.exit(child.wait())
+
+
+# -----------------------------
+# replay
+# -----------------------------
+def load_tool_calls(path):
+    """(offset_seconds, name, arguments) for every recorded tools/call request"""
+    calls = []
+    with open(path) as f:
+        for line in f:
+            entry = json.loads(line)
+            message = entry.get("msg", {})
+            if entry.get("dir") == "c2s" and message.get("method") == "tools/call":
+                params = message.get("params", {})
+                calls.append((entry["t"], params.get("name"), params.get("arguments") or {}))
+    if calls:
+        first = calls[0][0]
+        calls = [(t - first, name, arguments) for t, name, arguments in calls]
+    return calls
+
+
+async def replay(args):
+    calls = load_tool_calls(args.recording)
+    if not calls:
+        raise SystemExit(f"No tools/call requests in {args.recording}")
+    print(f"Replaying {len(calls)} tool calls from {args.recording} at speed {args.speed or 'max'}")
+    stats = Stats()
+    server_env = {"MCP_CANVAS_HEADLESS": "1"}
+    async with open_session(args.url, server_env) as session:
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            pending = []
+            for offset, name, arguments in calls:
+                if args.speed:
+                    delay = offset / args.speed - (time.perf_counter() - start)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    # Keep the recorded timing: don't wait for earlier calls
+                    pending.append(asyncio.create_task(timed_call(session, stats, name, arguments)))
+                else:
+                    await timed_call(session, stats, name, arguments)
+            await asyncio.gather(*pending)
+    stats.finished = time.perf_counter()
+    finish(stats.summary(), args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MCP server load generator and record/replay harness")
+    sub = parser.add_subparsers(dest="command_name", required=True)
+
+    run_parser = sub.add_parser("run", help="Generate load with a tool mix")
+    run_parser.add_argument("--sessions", type=int, default=4, help="Concurrent client sessions")
+    run_parser.add_argument("--inflight", type=int, default=1, help="Concurrent requests per session")
+    run_parser.add_argument("--duration", type=float, default=10.0, help="Seconds to run")
+    run_parser.add_argument("--requests", type=int, default=0, help="Stop each worker after this many calls")
+    run_parser.add_argument("--mix", default=DEFAULT_MIX, help="tool=weight,... ('canvas' = draw sequence)")
+    run_parser.add_argument("--seed", type=int, default=0)
+
+    replay_parser = sub.add_parser("replay", help="Replay a recorded session")
+    replay_parser.add_argument("recording", help="JSONL written by the proxy")
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="Pace multiplier (0 = no delays)")
+    replay_parser.add_argument("--repeat", type=int, default=1, help="Replay the recording this many times")
+
+    for p in (run_parser, replay_parser):
+        p.add_argument("--url", help="Streamable HTTP/SSE server URL instead of spawning stdio servers")
+        p.add_argument("--save", help="Write the summary to this JSON file (a baseline)")
+        p.add_argument("--baseline", help="Compare against a saved summary")
+
+    proxy_parser = sub.add_parser("proxy", help="Record JSON-RPC traffic of a stdio server")
+    proxy_parser.add_argument("--out", required=True, help="JSONL file to append to")
+    proxy_parser.add_argument("command", nargs=argparse.REMAINDER, help="-- server command")
+
+    args = parser.parse_args()
+    if args.command_name == "proxy":
+        if args.command and args.command[0] == "--":
+            args.command = args.command[1:]
+        proxy(args)
+    elif args.command_name == "run":
+        asyncio.run(run(args))
+    else:
+        asyncio.run(replay(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# -----------------------------
+# outbox.py
+# -----------------------------
+# Background delivery queue for fire-and-forget tool calls.
+#
+# Terminal side effects such as send-email or refresh_canvas don't feed any
+# later reasoning, so the agent loop hands them to an Outbox and goes straight
+# on to the next LLM call. Deliveries run with bounded concurrency and retries,
+# and the loop drains the outbox and prints a delivery report at the end of the
+# query.
+#
+# A call is only retried when it certainly never reached the tool (an open
+# circuit, a failed connection). A timeout or an error result may come after
+# the side effect already happened, and retrying could e.g. send an email twice.
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Optional
+
+from circuit_breaker import CircuitOpenError
+
+# Errors raised before the call reached the server
+RETRYABLE_ERRORS = (CircuitOpenError, ConnectionError)
+
+
+@dataclass
+class Delivery:
+    """Status record for a single queued tool call"""
+    id: int
+    tool: str
+    arguments: dict
+    status: str = "pending"  # pending -> running -> delivered | failed
+    attempts: int = 0
+    result: Any = None
+    error: Optional[str] = None
+    queued_at: float = field(default_factory=time.monotonic)
+    finished_at: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return end - self.queued_at
+
+
+class Outbox:
+    """Runs queued tool calls in the background with bounded concurrency"""
+
+    def __init__(self, concurrency: int = 4, max_retries: int = 2, backoff: float = 0.5):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.deliveries: list[Delivery] = []
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: list[asyncio.Task] = []
+
+    def submit(self, tool: str, arguments: dict,
+               call: Callable[[], Awaitable[Any]]) -> Delivery:
+        """Queue a tool call; `call` is invoked (possibly several times) to deliver it"""
+        delivery = Delivery(id=len(self.deliveries) + 1, tool=tool, arguments=arguments)
+        self.deliveries.append(delivery)
+        self._tasks.append(asyncio.create_task(self._deliver(delivery, call)))
+        return delivery
+
+    async def _deliver(self, delivery: Delivery, call: Callable[[], Awaitable[Any]]):
+        async with self._semaphore:
+            delivery.status = "running"
+            while True:
+                delivery.attempts += 1
+                try:
+                    result = await call()
+                    # MCP reports tool-side failures in the result rather than raising
+                    if getattr(result, 'isError', False):
+                        raise RuntimeError(_result_text(result))
+                    delivery.result = result
+                    delivery.status = "delivered"
+                    delivery.error = None
+                    break
+                except Exception as e:
+                    delivery.error = str(e) or type(e).__name__
+                    if not isinstance(e, RETRYABLE_ERRORS) or delivery.attempts > self.max_retries:
+                        delivery.status = "failed"
+                        break
+                    await asyncio.sleep(self.backoff * 2 ** (delivery.attempts - 1))
+            delivery.finished_at = time.monotonic()
+
+    @property
+    def pending(self) -> int:
+        return sum(1 for d in self.deliveries if d.status in ("pending", "running"))
+
+    async def drain(self, timeout: Optional[float] = None):
+        """Wait for every queued delivery to finish (or the timeout to expire)"""
+        if not self._tasks:
+            return
+        done, not_done = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in not_done:
+            task.cancel()
+        for delivery in self.deliveries:
+            if delivery.status in ("pending", "running"):
+                delivery.status = "failed"
+                delivery.error = delivery.error or "timed out waiting for delivery"
+                delivery.finished_at = time.monotonic()
+
+    def report(self) -> list[str]:
+        """One human-readable line per delivery"""
+        lines = []
+        for d in self.deliveries:
+            line = f"#{d.id} {d.tool}: {d.status} after {d.attempts} attempt(s) in {d.elapsed:.2f}s"
+            if d.status == "failed" and d.error:
+                line += f" - {d.error}"
+            lines.append(line)
+        return lines
+
+
+def _result_text(result) -> str:
+    content = getattr(result, 'content', None)
+    if isinstance(content, list):
+        return " ".join(getattr(item, 'text', str(item)) for item in content)
+    return str(result)
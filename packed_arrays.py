@@ -0,0 +1,150 @@
+# -----------------------------
+# packed_arrays.py
+# -----------------------------
+# Compact binary encoding for large numeric lists.
+#
+# Lists of tens of thousands of numbers are slow to send as JSON text arrays:
+# every element is formatted, parsed and re-stringified on both sides. A
+# packed array is a small JSON object holding the base64 of a typed
+# little-endian buffer:
+#
+#   {"__packed__": "array", "dtype": "int64" | "float64", "length": n, "data": "<base64>"}
+#
+# Packing is opt-in (MCP_PACKED_ARRAYS=1 in both the client and the server
+# environment; talk2mcp.py passes it on to the math server it spawns) and only
+# applies to lists of at least PACK_THRESHOLD numbers. Plain JSON stays the
+# default. Integers outside int64 (e.g. long Fibonacci sequences) are never
+# packed. With MCP_PACKED_NUMPY=1 (and NumPy installed) the client decodes
+# packed results into zero-copy NumPy views instead of array.array.
+import array
+import base64
+import json
+import os
+import sys
+
+PACK_THRESHOLD = int(os.getenv("MCP_PACK_THRESHOLD", "256"))
+
+# dtype name -> (array typecode, numpy dtype)
+_DTYPES = {
+    "int64": ("q", "<i8"),
+    "float64": ("d", "<f8"),
+}
+
+_INT64_MIN, _INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional; array.array is always available
+    numpy = None
+
+
+def packing_enabled() -> bool:
+    return os.getenv("MCP_PACKED_ARRAYS") == "1"
+
+
+def numpy_enabled() -> bool:
+    """Client side: decode packed results into NumPy views (MCP_PACKED_NUMPY=1)"""
+    return os.getenv("MCP_PACKED_NUMPY") == "1" and numpy is not None
+
+
+def is_packed(value) -> bool:
+    return isinstance(value, dict) and value.get("__packed__") == "array"
+
+
+def _dtype_for(values):
+    if all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        if all(_INT64_MIN <= v <= _INT64_MAX for v in values):
+            return "int64"
+        return None
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+        return "float64"
+    return None
+
+
+def pack(values) -> dict | None:
+    """Pack a list of numbers, or return None if it can't be packed"""
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        dtype = "int64" if values.dtype.kind in "iu" else "float64"
+        raw = values.astype(_DTYPES[dtype][1], copy=False).tobytes()
+        length = len(values)
+    else:
+        if isinstance(values, array.array):
+            values = values.tolist()
+        dtype = _dtype_for(values)
+        if dtype is None:
+            return None
+        buffer = array.array(_DTYPES[dtype][0], values)
+        if sys.byteorder == "big":
+            buffer.byteswap()
+        raw = buffer.tobytes()
+        length = len(buffer)
+    return {
+        "__packed__": "array",
+        "dtype": dtype,
+        "length": length,
+        "data": base64.b64encode(raw).decode("ascii"),
+    }
+
+
+def unpack(packed: dict, as_numpy: bool = False):
+    """Decode a packed array into an array.array (or a read-only NumPy view)"""
+    typecode, numpy_dtype = _DTYPES[packed["dtype"]]
+    raw = base64.b64decode(packed["data"])
+    if as_numpy and numpy is not None:
+        # Zero-copy view over the decoded bytes
+        values = numpy.frombuffer(raw, dtype=numpy_dtype)
+    else:
+        values = array.array(typecode)
+        values.frombytes(raw)
+        if sys.byteorder == "big":
+            values.byteswap()
+    if len(values) != packed["length"]:
+        raise ValueError(f"packed array length mismatch: {len(values)} != {packed['length']}")
+    return values
+
+
+def jsonable(value):
+    """json.dumps default=: decoded packed arrays (array.array / NumPy) become plain lists"""
+    return value.tolist() if hasattr(value, "tolist") else str(value)
+
+
+def maybe_pack(values):
+    """Server side: a packed JSON string for large numeric lists, else the list"""
+    if not packing_enabled() or len(values) < PACK_THRESHOLD:
+        return values
+    packed = pack(values)
+    return values if packed is None else json.dumps(packed)
+
+
+def unpack_text(text: str, as_numpy: bool = False):
+    """Client side: decode a tool result text if it is a packed array, else None"""
+    if not text.startswith('{"__packed__"'):
+        return None
+    try:
+        packed = json.loads(text)
+    except ValueError:
+        return None
+    return unpack(packed, as_numpy) if is_packed(packed) else None
+
+
+def pack_arguments(arguments: dict) -> dict:
+    """Client side: pack large numeric list arguments"""
+    if not packing_enabled():
+        return arguments
+    packed_arguments = {}
+    for name, value in arguments.items():
+        packed = None
+        if isinstance(value, (list, array.array)) and len(value) >= PACK_THRESHOLD:
+            packed = pack(value)
+        packed_arguments[name] = value if packed is None else packed
+    return packed_arguments
+
+
+def unpack_arguments(arguments: dict | None) -> dict | None:
+    """Server side: turn packed arguments back into plain lists for validation"""
+    if not arguments:
+        return arguments
+    return {
+        name: unpack(value).tolist() if is_packed(value) else value
+        for name, value in arguments.items()
+    }
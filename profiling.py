@@ -0,0 +1,256 @@
+# -----------------------------
+# profiling.py
+# -----------------------------
+# Built-in profiler for the agent client and the MCP servers.
+#
+# Two modes:
+#   sampling  A background thread samples the main thread's stack every few
+#             milliseconds (low overhead, fine for production runs). Output is
+#             collapsed stacks (flamegraph.pl / speedscope) plus a speedscope
+#             JSON file.
+#   cprofile  Deterministic cProfile; output is a .prof file for pstats /
+#             snakeviz.
+#
+# Samples are grouped under a label (e.g. "query-1a2b3c4d"), and each label is
+# written to its own file named <process>-<pid>-<label>.* in the output
+# directory. labelled() ties a label to the frame of the function that opened
+# it, and the sampler attributes a sample to the innermost labelled frame on
+# the sampled stack. Concurrent queries on one event loop therefore each get
+# their own samples. cProfile can only be switched process-wide, so in cprofile
+# mode the labels are exact only when queries run one at a time.
+#
+# Switch it on with `--profile` on talk2mcp.py / example_macp_server_mac.py,
+# with MCP_PROFILE=sampling|cprofile in the environment, or on a running
+# process with `kill -USR1 <pid>` (send it again to stop and write the output).
+import atexit
+import cProfile
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+DEFAULT_DIR = os.getenv("MCP_PROFILE_DIR", "profiles")
+DEFAULT_INTERVAL = float(os.getenv("MCP_PROFILE_INTERVAL", "0.005"))
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Profiler:
+    """Per-process profiler that groups its output by label"""
+
+    def __init__(self, mode="sampling", out_dir=DEFAULT_DIR, process="client",
+                 interval=DEFAULT_INTERVAL):
+        if mode not in ("sampling", "cprofile"):
+            raise ValueError(f"Unknown profile mode: {mode}")
+        self.mode = mode
+        self.out_dir = out_dir
+        self.process = process
+        self.interval = interval
+        self.label = "main"
+        self.running = False
+        self._frame_labels = {}  # frame -> label, for the sampler
+        self._open_labels = []   # labelled() blocks still open, oldest first
+        self._thread_id = threading.main_thread().ident
+        self._samples = defaultdict(lambda: defaultdict(int))  # label -> stack -> count
+        self._profiles = {}  # label -> cProfile.Profile
+        self._sampler = None
+        self._started = None
+
+    # ---- control -------------------------------------------------------
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self._started = time.monotonic()
+        if self.mode == "sampling":
+            self._sampler = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+            self._sampler.start()
+        else:
+            self._cprofile(self.label).enable()
+        print(f"PROFILE: {self.mode} profiling started ({self.process} pid {os.getpid()})", file=sys.stderr)
+
+    def stop(self):
+        """Stop profiling and write the output; returns the written paths"""
+        if not self.running:
+            return []
+        self.running = False
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+        for profile in self._profiles.values():
+            profile.disable()
+        paths = self.write()
+        print(f"PROFILE: wrote {', '.join(paths) or 'nothing'}", file=sys.stderr)
+        return paths
+
+    def set_label(self, label):
+        if self.mode == "cprofile" and self.running and label != self.label:
+            self._cprofile(self.label).disable()
+            self._cprofile(label).enable()
+        self.label = label
+
+    def enter_label(self, label, frame):
+        """Attribute `frame` and everything it calls to `label` until exit_label"""
+        entry = (label, frame, self._frame_labels.get(frame))
+        self._open_labels.append(entry)
+        self._frame_labels[frame] = label
+        self.set_label(label)
+        return entry
+
+    def exit_label(self, entry):
+        _, frame, previous = entry
+        self._open_labels.remove(entry)
+        if previous is None:
+            self._frame_labels.pop(frame, None)
+        else:
+            self._frame_labels[frame] = previous
+        # Blocks may close out of order when queries interleave
+        self.set_label(self._open_labels[-1][0] if self._open_labels else "main")
+
+    # ---- collection ----------------------------------------------------
+
+    def _cprofile(self, label):
+        if label not in self._profiles:
+            self._profiles[label] = cProfile.Profile()
+        return self._profiles[label]
+
+    def _sample_loop(self):
+        while self.running:
+            time.sleep(self.interval)
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            label = None
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                if label is None:
+                    label = self._frame_labels.get(frame)
+                frame = frame.f_back
+            if stack:
+                self._samples[label or "main"][tuple(reversed(stack))] += 1
+
+    # ---- output --------------------------------------------------------
+
+    def _path(self, label, suffix):
+        safe_label = "".join(c if c.isalnum() or c in "-_." else "_" for c in label)
+        return os.path.join(self.out_dir, f"{self.process}-{os.getpid()}-{safe_label}{suffix}")
+
+    def write(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        paths = []
+        if self.mode == "cprofile":
+            for label, profile in self._profiles.items():
+                path = self._path(label, ".prof")
+                profile.dump_stats(path)
+                paths.append(path)
+            return paths
+
+        for label, stacks in self._samples.items():
+            path = self._path(label, ".collapsed")
+            with open(path, "w") as f:
+                for stack, count in sorted(stacks.items(), key=lambda kv: -kv[1]):
+                    f.write(f"{';'.join(stack)} {count}\n")
+            paths.append(path)
+
+            path = self._path(label, ".speedscope.json")
+            with open(path, "w") as f:
+                json.dump(self._speedscope(label, stacks), f)
+            paths.append(path)
+        return paths
+
+    def _speedscope(self, label, stacks):
+        frames = []
+        index = {}
+        samples = []
+        weights = []
+        for stack, count in stacks.items():
+            sample = []
+            for name in stack:
+                if name not in index:
+                    index[name] = len(frames)
+                    frames.append({"name": name})
+                sample.append(index[name])
+            samples.append(sample)
+            weights.append(count * self.interval)
+        total = sum(weights)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": f"{self.process} {label}",
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": total,
+                "samples": samples,
+                "weights": weights,
+            }],
+            "name": f"{self.process}-{os.getpid()}-{label}",
+            "activeProfileIndex": 0,
+            "exporter": "mcp-agentic-cnc profiling.py",
+        }
+
+
+# -----------------------------
+# Process-wide profiler
+# -----------------------------
+active = None
+
+
+def start(mode="sampling", out_dir=DEFAULT_DIR, process="client"):
+    """Start the process-wide profiler and write its output at exit"""
+    global active
+    if active is None:
+        active = Profiler(mode, out_dir, process)
+        atexit.register(stop)
+    active.start()
+    return active
+
+
+def stop():
+    if active is not None:
+        return active.stop()
+    return []
+
+
+def start_from_env(process):
+    """Start profiling if MCP_PROFILE=sampling|cprofile is set"""
+    mode = os.getenv("MCP_PROFILE")
+    if mode:
+        return start(mode, DEFAULT_DIR, process)
+    return None
+
+
+def install_toggle_signal(process, mode=None):
+    """Let `kill -USR1 <pid>` start/stop profiling on a running process"""
+    if not hasattr(signal, "SIGUSR1"):
+        return
+
+    def toggle(signum, frame):
+        if active is not None and active.running:
+            stop()
+        else:
+            start(mode or os.getenv("MCP_PROFILE") or "sampling", DEFAULT_DIR, process)
+
+    signal.signal(signal.SIGUSR1, toggle)
+
+
+@contextmanager
+def labelled(label):
+    """Attribute samples taken inside the block to `label`"""
+    if active is None:
+        yield
+        return
+    # The function running the `with` statement (past contextmanager's __enter__)
+    entry = active.enter_label(label, sys._getframe(2))
+    try:
+        yield
+    finally:
+        active.exit_label(entry)
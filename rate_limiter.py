@@ -0,0 +1,156 @@
+# -----------------------------
+# rate_limiter.py
+# -----------------------------
+# Shared, adaptive rate limiting for LLM calls.
+#
+# Under batch load the bottleneck is Gemini quota (429 RESOURCE_EXHAUSTED) and
+# latency spikes, not the agent. Every LLM call goes through one
+# AdaptiveLimiter, which combines:
+#   - token buckets for requests per minute and (estimated) tokens per minute
+#   - AIMD concurrency control: the in-flight limit grows by ~1 per window of
+#     successful calls and halves on a 429 or timeout
+#   - priority lanes: waiting "interactive" calls are always admitted before
+#     waiting "batch" calls
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Optional
+
+# Lower rank = served first
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `rate` per second"""
+
+    def __init__(self, per_minute: float, burst_seconds: float = 15.0):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available (0 if they are now)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+
+def is_throttled(error: Exception) -> bool:
+    """Does this exception mean the backend is rate limiting us?
+
+    Only the structured fields count (google.genai's ClientError and
+    LocalThrottleError carry code/status); matching "429" in the message
+    would also catch e.g. "port 4290".
+    """
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    return code == 429 or getattr(error, "status", None) == "RESOURCE_EXHAUSTED"
+
+
+class AdaptiveLimiter:
+    """Token buckets + AIMD concurrency limit + priority lanes"""
+
+    def __init__(self, requests_per_minute: float = 60, tokens_per_minute: float = 1_000_000,
+                 initial_concurrency: float = 4, max_concurrency: float = 16,
+                 min_concurrency: float = 1, decrease_cooldown: float = 1.0):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.limit = float(initial_concurrency)
+        self.max_concurrency = float(max_concurrency)
+        self.min_concurrency = float(min_concurrency)
+        self.decrease_cooldown = decrease_cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._waiters: list = []
+        self._sequence = itertools.count()
+        self._condition: Optional[asyncio.Condition] = None
+        # Metrics
+        self.completed = 0
+        self.throttled = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.wait_seconds = {lane: 0.0 for lane in PRIORITIES}
+        self.admitted = {lane: 0 for lane in PRIORITIES}
+
+    @property
+    def _cond(self) -> asyncio.Condition:
+        # Created lazily so the limiter can be built before the event loop runs
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self, estimated_tokens: int = 1, priority: str = "interactive"):
+        """Wait until this call may start"""
+        entry = (PRIORITIES.get(priority, len(PRIORITIES)), next(self._sequence))
+        started = time.monotonic()
+        async with self._cond:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    timeout = None
+                    if self._waiters[0] == entry and self.in_flight < max(1, int(self.limit)):
+                        timeout = max(self.requests.wait_time(1), self.tokens.wait_time(estimated_tokens))
+                        if timeout == 0:
+                            break
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+                raise
+            heapq.heappop(self._waiters)
+            self.requests.consume(1)
+            self.tokens.consume(estimated_tokens)
+            self.in_flight += 1
+            lane = priority if priority in PRIORITIES else "batch"
+            self.admitted[lane] += 1
+            self.wait_seconds[lane] += time.monotonic() - started
+            # The next waiter may be able to go too
+            self._cond.notify_all()
+
+    async def release(self, outcome: str):
+        """Finish a call; outcome is "success", "throttled", "timeout" or "error" """
+        async with self._cond:
+            self.in_flight -= 1
+            if outcome == "success":
+                self.completed += 1
+                # Additive increase: +1 per `limit` successful calls
+                self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+            elif outcome in ("throttled", "timeout"):
+                if outcome == "throttled":
+                    self.throttled += 1
+                else:
+                    self.timeouts += 1
+                # Multiplicative decrease, at most once per cooldown so a burst
+                # of failures from one overload doesn't collapse the limit
+                now = time.monotonic()
+                if now - self._last_decrease >= self.decrease_cooldown:
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                    self._last_decrease = now
+            else:
+                self.errors += 1
+            self._cond.notify_all()
+
+    def report(self) -> str:
+        waits = ", ".join(
+            f"{lane} {self.admitted[lane]} admitted / {self.wait_seconds[lane] / self.admitted[lane]:.2f}s avg wait"
+            for lane in PRIORITIES if self.admitted[lane]
+        )
+        return (f"limit {self.limit:.1f}, {self.in_flight} in flight, {self.completed} ok, "
+                f"{self.throttled} throttled, {self.timeouts} timeouts, {self.errors} errors"
+                + (f"; {waits}" if waits else ""))
@@ -0,0 +1,255 @@
+# -----------------------------
+# run_journal.py
+# -----------------------------
+# Crash-safe, append-only journal of query runs, with resume.
+#
+# Every run appends JSONL records, keyed by a run id unique to that run
+# (<query_id>-<random suffix>), to one journal file (MCP_JOURNAL_PATH,
+# default run_journal.jsonl; set it empty to disable):
+#   start         {query, query_id}                       query_id is the caller's id
+#   llm           {iteration, prompt_hash, text, call}    the model's decision
+#   tool_started  {iteration, tool, arguments}            before a side effect
+#   tool_done     {iteration, tool, arguments, result}
+#   queued        {iteration, tool, arguments}            handed to the outbox
+#   delivered     {iteration, tool, ok}
+#   final         {answer}
+#   end           {}
+#
+# Writes stay off the event loop: append() only puts the record on a queue.
+# A writer thread serialises the queued records, writes them with one
+# os.write and then fsyncs once per batch (group commit). The one exception
+# is a tool that isn't idempotent. Before such a tool runs, its tool_started
+# record is written with append_durable(), which waits for the fsync. A
+# resumed run can therefore always tell that it may have happened, and it is
+# never executed twice (at most once). Pure tools and LLM responses are
+# simply redone if their records were lost.
+#
+# If the journal can't be written (missing directory, read-only disk, ENOSPC),
+# the waiting durable writes fail with JournalError, so their side effects are
+# not run. The journal then switches itself off with a warning. A durable write
+# also fails if its fsync takes longer than MCP_JOURNAL_DURABLE_TIMEOUT seconds.
+#
+# Resume with `python3 talk2mcp.py --resume [RUN_ID]` (default: the latest
+# run without an end record). Completed steps are restored from the journal
+# without calling the LLM or the tools again.
+import asyncio
+import atexit
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from typing import Optional
+
+from packed_arrays import jsonable
+
+JOURNAL_PATH = os.getenv("MCP_JOURNAL_PATH", "run_journal.jsonl")
+DURABLE_TIMEOUT = float(os.getenv("MCP_JOURNAL_DURABLE_TIMEOUT", "10"))
+
+
+class JournalError(Exception):
+    """A durable journal write failed or timed out"""
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode()).hexdigest()[:16]
+
+
+class RunJournal:
+    """Append-only JSONL journal with a background group-commit writer"""
+
+    def __init__(self, path: Optional[str] = JOURNAL_PATH, flush_interval: float = 0.05,
+                 max_batch: int = 512, durable_timeout: float = DURABLE_TIMEOUT):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.durable_timeout = durable_timeout
+        self.error: Optional[OSError] = None  # set once writing failed; the journal is off from then on
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+        # Metrics
+        self.records = 0
+        self.batches = 0
+        self.bytes = 0
+        self.append_seconds = 0.0  # time spent by callers in append()
+        self.fsync_seconds = 0.0   # time the writer thread spent in fsync
+        self.durable_waits = 0
+        self.durable_wait_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path) and self.error is None
+
+    def _ensure_writer(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._write_loop, name="run-journal", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def append(self, run: str, kind: str, **data):
+        """Queue a record; returns immediately"""
+        if not self.enabled:
+            return
+        started = time.perf_counter()
+        self._ensure_writer()
+        self._queue.put(({"run": run, "type": kind, "ts": time.time(), **data}, None))
+        self.records += 1
+        self.append_seconds += time.perf_counter() - started
+
+    async def append_durable(self, run: str, kind: str, **data):
+        """Queue a record and wait until it has been fsynced"""
+        if not self.enabled:
+            return
+        started = time.perf_counter()
+        self._ensure_writer()
+        loop = asyncio.get_running_loop()
+        written = loop.create_future()
+        self._queue.put(({"run": run, "type": kind, "ts": time.time(), **data}, (loop, written)))
+        self.records += 1
+        try:
+            await asyncio.wait_for(written, self.durable_timeout)
+        except asyncio.TimeoutError:
+            raise JournalError(f"journal fsync took longer than {self.durable_timeout}s") from None
+        self.durable_waits += 1
+        self.durable_wait_seconds += time.perf_counter() - started
+
+    def _write_loop(self):
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        except OSError as e:
+            fd = None
+            self._disable(e)
+        # Keep draining after a failure so every durable waiter gets an answer
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+                batch = [item]
+                # Wait a little for more records unless someone is waiting on this one
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.max_batch:
+                    timeout = 0 if any(w for _, w in batch) else deadline - time.monotonic()
+                    try:
+                        item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        self._flush(fd, batch)
+                        return
+                    batch.append(item)
+                self._flush(fd, batch)
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def _disable(self, error: OSError):
+        self.error = error
+        print(f"⚠️  Run journal {self.path} can't be written ({error}); journaling is off")
+
+    def _flush(self, fd, batch):
+        if self.error is None:
+            data = "".join(json.dumps(record, default=jsonable) + "\n" for record, _ in batch).encode()
+            try:
+                # One write per batch: O_APPEND keeps concurrent writers' batches whole
+                os.write(fd, data)
+                started = time.perf_counter()
+                os.fsync(fd)
+            except OSError as e:
+                self._disable(e)
+            else:
+                self.fsync_seconds += time.perf_counter() - started
+                self.batches += 1
+                self.bytes += len(data)
+        for _, waiter in batch:
+            if waiter is None:
+                continue
+            loop, written = waiter
+            if self.error is None:
+                loop.call_soon_threadsafe(lambda f=written: f.done() or f.set_result(None))
+            else:
+                error = JournalError(f"journal write failed: {self.error}")
+                loop.call_soon_threadsafe(lambda f=written, e=error: f.done() or f.set_exception(e))
+
+    def close(self):
+        """Flush everything queued and stop the writer"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def report(self) -> str:
+        batches = self.batches or 1
+        line = (f"{self.records} records in {self.batches} fsynced batches "
+                f"({self.fsync_seconds / batches * 1000:.2f}ms avg fsync, off the event loop), "
+                f"{self.append_seconds / max(self.records, 1) * 1e6:.1f}µs avg append")
+        if self.durable_waits:
+            line += (f", {self.durable_waits} durable writes before side effects "
+                     f"({self.durable_wait_seconds / self.durable_waits * 1000:.2f}ms avg wait)")
+        return line
+
+
+# -----------------------------
+# Reading and resuming
+# -----------------------------
+def load_runs(path: str = JOURNAL_PATH) -> dict[str, list[dict]]:
+    """All records grouped by run id, in journal order"""
+    runs = defaultdict(list)
+    if not path or not os.path.exists(path):
+        return runs
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # torn last line from a crash mid-write
+            runs[record["run"]].append(record)
+    return runs
+
+
+def latest_unfinished(path: str = JOURNAL_PATH) -> Optional[str]:
+    unfinished = [run for run, records in load_runs(path).items()
+                  if records[0]["type"] == "start" and not any(r["type"] == "end" for r in records)]
+    return unfinished[-1] if unfinished else None
+
+
+class ResumeLog:
+    """What a crashed run got done, looked up step by step while re-running it"""
+
+    def __init__(self, run: str, records: list[dict]):
+        if not records or records[0]["type"] != "start":
+            raise ValueError(f"run {run} has no start record")
+        self.run = run
+        self.query = records[0]["query"]
+        self.query_id = records[0].get("query_id", run)
+        self.steps = defaultdict(dict)  # iteration -> record type -> record
+        self.final_answer = None
+        for record in records:
+            if "iteration" in record:
+                self.steps[record["iteration"]][record["type"]] = record
+            elif record["type"] == "final":
+                self.final_answer = record["answer"]
+        self.restored = 0
+
+    def llm_response(self, iteration: int, prompt_digest: str) -> Optional[dict]:
+        """The journaled LLM decision, if the prompt is the same as before"""
+        record = self.steps.get(iteration, {}).get("llm")
+        if record is not None and record["prompt_hash"] == prompt_digest:
+            self.restored += 1
+            return record
+        return None
+
+    def tool_outcome(self, iteration: int, tool: str, arguments: dict) -> Optional[dict]:
+        """The journal records for this exact call at this step, if any"""
+        step = self.steps.get(iteration, {})
+        for kind in ("tool_done", "tool_started", "queued"):
+            record = step.get(kind)
+            if record is not None and (record["tool"], record["arguments"]) != (tool, arguments):
+                return None
+        if not step.keys() & {"tool_done", "tool_started", "queued"}:
+            return None
+        self.restored += 1
+        return step
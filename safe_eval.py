@@ -0,0 +1,185 @@
+# -----------------------------
+# safe_eval.py
+# -----------------------------
+# Safe arithmetic expression evaluation for the `evaluate` MCP tool.
+#
+# Expressions are parsed with `ast` and only a whitelist of node types is
+# accepted (numbers, variables, + - * / // % **, unary +/-, and calls to the
+# functions in FUNCTIONS). Nothing is ever passed to eval(). Each expression is
+# compiled once into a tree of closures and cached, so re-evaluating the same
+# expression with different variables skips parsing entirely.
+import ast
+import json
+import math
+import operator
+from functools import lru_cache
+
+MAX_EXPRESSION_LENGTH = 1000
+MAX_EXPONENT = 10000
+MAX_FACTORIAL = 1500  # 1500! has 4115 digits
+# Keeps integer results under Python's 4300-digit int/str conversion limit,
+# so every result can be serialised
+MAX_RESULT_BITS = 14_000
+
+
+def _pow(a, b):
+    if isinstance(b, (int, float)) and abs(b) > MAX_EXPONENT:
+        raise ValueError(f"exponent {b} is too large (max {MAX_EXPONENT})")
+    if isinstance(a, int) and isinstance(b, int) and b > 0 and a.bit_length() * b > MAX_RESULT_BITS:
+        raise ValueError("result is too large")
+    result = a ** b
+    # A negative base with a fractional exponent, e.g. (-8)**(1/3)
+    if isinstance(result, complex):
+        raise ValueError("complex result")
+    return result
+
+
+def _factorial(a):
+    if a > MAX_FACTORIAL:
+        raise ValueError(f"factorial argument {a} is too large (max {MAX_FACTORIAL})")
+    return math.factorial(int(a))
+
+
+def _fibonacci(n):
+    """n-th Fibonacci number (fibonacci(0) = 0, fibonacci(1) = 1)"""
+    n = int(n)
+    if n < 0 or n > MAX_EXPONENT:
+        raise ValueError(f"fibonacci argument must be between 0 and {MAX_EXPONENT}")
+    a, b = 0, 1
+    for _ in range(n):
+        a, b = b, a + b
+    return a
+
+
+FUNCTIONS = {
+    "sqrt": math.sqrt,
+    "cbrt": lambda a: math.copysign(abs(a) ** (1 / 3), a),
+    "exp": math.exp,
+    "log": math.log,
+    "log10": math.log10,
+    "sin": math.sin,
+    "cos": math.cos,
+    "tan": math.tan,
+    "factorial": _factorial,
+    "fibonacci": _fibonacci,
+    "abs": abs,
+    "round": round,
+    "floor": math.floor,
+    "ceil": math.ceil,
+    "min": min,
+    "max": max,
+    "pow": _pow,
+    "remainder": operator.mod,
+}
+
+CONSTANTS = {"pi": math.pi, "e": math.e, "tau": math.tau}
+
+_BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: _pow,
+}
+
+_UNARY_OPERATORS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+
+def _compile(node):
+    """Turn a whitelisted AST node into a function of the variable bindings"""
+    if isinstance(node, ast.Constant):
+        value = node.value
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"unsupported constant {value!r}")
+        return lambda env: value
+
+    if isinstance(node, ast.Name):
+        name = node.id
+        if name in CONSTANTS:
+            # Variable bindings shadow the constants, so "e=5" means e is 5
+            value = CONSTANTS[name]
+            return lambda env: env.get(name, value)
+
+        def lookup(env):
+            try:
+                return env[name]
+            except KeyError:
+                raise ValueError(f"unknown variable '{name}'") from None
+        return lookup
+
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+        op = _BINARY_OPERATORS[type(node.op)]
+        left, right = _compile(node.left), _compile(node.right)
+        return lambda env: op(left(env), right(env))
+
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPERATORS:
+        op = _UNARY_OPERATORS[type(node.op)]
+        operand = _compile(node.operand)
+        return lambda env: op(operand(env))
+
+    if isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+            name = getattr(node.func, "id", ast.dump(node.func))
+            raise ValueError(f"unknown function '{name}'")
+        if node.keywords:
+            raise ValueError("keyword arguments are not supported")
+        func = FUNCTIONS[node.func.id]
+        args = [_compile(arg) for arg in node.args]
+        return lambda env: func(*(arg(env) for arg in args))
+
+    raise ValueError(f"unsupported syntax: {type(node).__name__}")
+
+
+@lru_cache(maxsize=512)
+def compile_expression(expression: str):
+    """Parse and compile an expression once; cached by expression text"""
+    if len(expression) > MAX_EXPRESSION_LENGTH:
+        raise ValueError(f"expression is longer than {MAX_EXPRESSION_LENGTH} characters")
+    # People (and LLMs) write ^ for powers
+    tree = ast.parse(expression.replace("^", "**"), mode="eval")
+    return _compile(tree.body)
+
+
+def parse_variables(variables) -> dict:
+    """Variable bindings from a dict, a JSON object, or "a=1, b=2.5" text"""
+    if not variables:
+        return {}
+    if isinstance(variables, dict):
+        items = variables.items()
+    else:
+        text = variables.strip()
+        if text.startswith("{"):
+            items = json.loads(text).items()
+        else:
+            items = []
+            for binding in text.replace(";", ",").split(","):
+                if not binding.strip():
+                    continue
+                name, sep, value = binding.partition("=")
+                if not sep:
+                    raise ValueError(f"expected name=value, got '{binding.strip()}'")
+                items.append((name.strip(), value.strip()))
+
+    bindings = {}
+    for name, value in items:
+        if not str(name).isidentifier():
+            raise ValueError(f"invalid variable name '{name}'")
+        if isinstance(value, str):
+            value = float(value) if any(c in value for c in ".eE") or value in ("inf", "-inf") else int(value)
+        bindings[name] = value
+    return bindings
+
+
+def evaluate(expression: str, variables=None):
+    """Evaluate an arithmetic expression with optional variable bindings"""
+    result = compile_expression(expression.strip())(parse_variables(variables))
+    if isinstance(result, int) and result.bit_length() > MAX_RESULT_BITS:
+        raise ValueError("result is too large")
+    if isinstance(result, complex):
+        raise ValueError("complex result")
+    return result
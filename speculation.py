@@ -0,0 +1,224 @@
+# -----------------------------
+# speculation.py
+# -----------------------------
+# Speculative next-tool execution.
+#
+# Query traces are very predictable: strings_to_chars_to_int is almost always
+# followed by int_list_to_exponential_sum or add_list on its output. The
+# Speculator keeps transition statistics per (tool -> next tool, argument
+# mapping) and, while the LLM is deciding the next step, runs the most likely
+# next call if that tool is side-effect free. If the LLM picks the same call
+# the result is already there; otherwise it is discarded and counted as waste.
+import asyncio
+import json
+import os
+import time
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Optional
+
+# Only pure tools may ever be run speculatively
+SIDE_EFFECT_FREE_TOOLS = {
+    'add', 'add_list', 'subtract', 'multiply', 'divide', 'power', 'sqrt', 'cbrt',
+    'factorial', 'log', 'remainder', 'sin', 'cos', 'tan', 'mine',
+    'strings_to_chars_to_int', 'int_list_to_exponential_sum', 'fibonacci_numbers', 'evaluate',
+}
+
+STATS_PATH = os.getenv("MCP_TRANSITIONS_PATH", "tool_transitions.json")
+
+# Marker used in argument mappings for "the previous tool's result"
+PREV_RESULT = "$prev"
+
+
+def returns_list(tool) -> bool:
+    """Whether a tool's output schema declares a list result.
+
+    FastMCP wraps non-object return types as {"result": <schema>}, so
+    `-> list[int] | str` shows up as an anyOf containing an array.
+    """
+    schema = getattr(tool, 'outputSchema', None) or {}
+    result = schema.get("properties", {}).get("result", {})
+    return any(option.get("type") == "array" for option in result.get("anyOf", [result]))
+
+
+def result_value(iteration_result, as_list: bool = False) -> Any:
+    """Turn the text content of a tool result back into a Python value.
+
+    FastMCP returns list results as one text item per element, so a
+    multi-item result becomes a list and a single item becomes a scalar,
+    unless `as_list` says the tool returns a list (see returns_list), in
+    which case a one-element list stays a list. Decoded packed arrays are
+    already numbers.
+    """
+    if hasattr(iteration_result, 'tolist'):
+        return iteration_result.tolist()
+    items = iteration_result if isinstance(iteration_result, list) else [iteration_result]
+    values = []
+    for item in items:
+        try:
+            values.append(json.loads(item))
+        except (TypeError, ValueError):
+            values.append(item)
+    return values[0] if len(values) == 1 and not as_list else values
+
+
+def _argument_mapping(arguments: dict, prev_value) -> tuple:
+    """Describe how `arguments` derive from the previous result (hashable)"""
+    mapping = []
+    for name, value in sorted(arguments.items()):
+        if prev_value is not None and value == prev_value:
+            mapping.append((name, PREV_RESULT))
+        else:
+            mapping.append((name, json.dumps(value, sort_keys=True)))
+    return tuple(mapping)
+
+
+def _build_arguments(mapping: tuple, prev_value) -> dict:
+    return {
+        name: prev_value if source == PREV_RESULT else json.loads(source)
+        for name, source in mapping
+    }
+
+
+class TransitionStats:
+    """Counts of (tool -> next tool, argument mapping) transitions"""
+
+    def __init__(self, path: Optional[str] = STATS_PATH):
+        self.path = path
+        self.counts: dict[str, dict[tuple, int]] = defaultdict(lambda: defaultdict(int))
+        self._saved: dict[tuple, int] = {}  # counts as of the last load/save
+        self.load()
+
+    def record(self, prev_tool: str, next_tool: str, mapping: tuple):
+        self.counts[prev_tool][(next_tool, mapping)] += 1
+
+    def most_likely(self, prev_tool: str) -> Optional[tuple[str, tuple, float, int]]:
+        """Return (next_tool, mapping, probability, count) for the top transition"""
+        transitions = self.counts.get(prev_tool)
+        if not transitions:
+            return None
+        total = sum(transitions.values())
+        (next_tool, mapping), count = max(transitions.items(), key=lambda kv: kv[1])
+        return next_tool, mapping, count / total, count
+
+    def _read(self) -> dict[tuple, int]:
+        """Counts on disk as {(from, to, mapping): count}"""
+        counts = {}
+        if not self.path or not os.path.exists(self.path):
+            return counts
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            for entry in data:
+                mapping = tuple(tuple(pair) for pair in entry["mapping"])
+                counts[(entry["from"], entry["to"], mapping)] = entry["count"]
+        except Exception as e:
+            print(f"DEBUG: Ignoring unreadable transition stats {self.path}: {e}")
+        return counts
+
+    def load(self):
+        self._adopt(self._read())
+
+    def _adopt(self, counts: dict[tuple, int]):
+        self.counts.clear()
+        for (prev_tool, next_tool, mapping), count in counts.items():
+            self.counts[prev_tool][(next_tool, mapping)] = count
+        self._saved = counts
+
+    def save(self):
+        if not self.path:
+            return
+        import fcntl
+        # Worker processes share the file: under a lock, add the counts this
+        # process gained since its last load/save to what is on disk now
+        with open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            merged = self._read()
+            for prev_tool, transitions in self.counts.items():
+                for (next_tool, mapping), count in transitions.items():
+                    key = (prev_tool, next_tool, mapping)
+                    merged[key] = merged.get(key, 0) + count - self._saved.get(key, 0)
+            data = [
+                {"from": prev_tool, "to": next_tool, "mapping": [list(p) for p in mapping], "count": count}
+                for (prev_tool, next_tool, mapping), count in merged.items()
+            ]
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        self._adopt(merged)
+
+
+class Speculator:
+    """Runs the most likely pure next call while the LLM is thinking"""
+
+    def __init__(self, stats: TransitionStats, min_probability: float = 0.5, min_count: int = 2):
+        self.stats = stats
+        self.min_probability = min_probability
+        self.min_count = min_count
+        self.launched = 0
+        self.hits = 0
+        self.wasted = 0
+        self.wasted_seconds = 0.0
+        self._prev_tool: Optional[str] = None
+        self._prev_value: Any = None
+        self._pending: Optional[tuple[str, dict, asyncio.Task, float]] = None
+
+    def observe(self, tool: str, arguments: dict, value: Any):
+        """Record an executed call and learn the transition that led to it"""
+        if self._prev_tool is not None:
+            self.stats.record(self._prev_tool, tool, _argument_mapping(arguments, self._prev_value))
+        self._prev_tool = tool
+        self._prev_value = value
+
+    def speculate(self, call: Callable[[str, dict], Awaitable[Any]]):
+        """Start the predicted next call in the background, if confident enough"""
+        self.discard()
+        if self._prev_tool is None:
+            return
+        prediction = self.stats.most_likely(self._prev_tool)
+        if prediction is None:
+            return
+        next_tool, mapping, probability, count = prediction
+        if next_tool not in SIDE_EFFECT_FREE_TOOLS:
+            return
+        if probability < self.min_probability or count < self.min_count:
+            return
+        arguments = _build_arguments(mapping, self._prev_value)
+        print(f"DEBUG: Speculating {next_tool}({arguments}) p={probability:.2f}")
+        task = asyncio.create_task(call(next_tool, arguments))
+        self._pending = (next_tool, arguments, task, time.monotonic())
+        self.launched += 1
+
+    async def claim(self, tool: str, arguments: dict) -> Optional[Any]:
+        """Return the speculative result if it matches the chosen call, else None"""
+        if self._pending is None:
+            return None
+        spec_tool, spec_arguments, task, _ = self._pending
+        if spec_tool != tool or spec_arguments != arguments:
+            self.discard()
+            return None
+        self._pending = None
+        try:
+            result = await task
+        except Exception as e:
+            # Count it as waste and let the caller run the call for real
+            print(f"DEBUG: Speculative {tool} failed: {e}")
+            self.wasted += 1
+            return None
+        self.hits += 1
+        return result
+
+    def discard(self):
+        """Throw away an unclaimed speculative call"""
+        if self._pending is None:
+            return
+        _, _, task, started = self._pending
+        self._pending = None
+        task.cancel()
+        self.wasted += 1
+        self.wasted_seconds += time.monotonic() - started
+
+    def report(self) -> str:
+        hit_rate = self.hits / self.launched if self.launched else 0.0
+        return (f"{self.launched} launched, {self.hits} hits ({hit_rate:.0%}), "
+                f"{self.wasted} wasted ({self.wasted_seconds:.2f}s of tool time)")
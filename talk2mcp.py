@@ -1,159 +1,415 @@
 import os
+import argparse
+import contextvars
+import inspect
+import uuid
 from dotenv import load_dotenv
 from mcp import ClientSession, StdioServerParameters, types
-from mcp.client.stdio import stdio_client
+from mcp.client.stdio import stdio_client, get_default_environment
 import asyncio
+from contextlib import AsyncExitStack, suppress
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Optional
 from google import genai
+from google.genai import types as genai_types
 from concurrent.futures import TimeoutError
-from functools import partial
+from outbox import Outbox
+from speculation import Speculator, TransitionStats, result_value, returns_list, SIDE_EFFECT_FREE_TOOLS
+from workflow_cache import WorkflowCache, result_text
+from loop_guard import LoopGuard
+from local_backend import LocalStandInClient
+from packed_arrays import numpy_enabled, pack_arguments, unpack_text
+from rate_limiter import AdaptiveLimiter, is_throttled
+from circuit_breaker import CircuitBreaker, ToolTimeoutError, call_timeout
+from run_journal import RunJournal, ResumeLog, load_runs, latest_unfinished, prompt_hash
+import fork_server
+import profiling
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Access your API key and initialize Gemini client correctly
-api_key = os.getenv("GEMINI_API_KEY")
-client = genai.Client(api_key=api_key)
+# LLM_BACKEND=local swaps Gemini for the offline stand-in planner
+llm_backend = os.getenv("LLM_BACKEND", "gemini")
+if llm_backend == "local":
+    client = LocalStandInClient()
+else:
+    # Access your API key and initialize Gemini client correctly
+    api_key = os.getenv("GEMINI_API_KEY")
+    client = genai.Client(api_key=api_key)
+
+# LLM_PROTOCOL=native passes the MCP tool schemas to Gemini as function
+# declarations and reads structured calls back; "text" is the
+# FUNCTION_CALL: name|p1|p2 line protocol (always used by the local backend)
+llm_protocol = "text" if llm_backend == "local" else os.getenv("LLM_PROTOCOL", "native")
 
 max_iterations = 15  # Increased for math + canvas visualization + email steps
-last_response = None
-iteration = 0
-iteration_response = []
+max_stalled_iterations = 3  # End a query early after this many wasted iterations in a row
+
+# Side-effecting tools whose results don't affect later reasoning.
+# These are queued on the outbox and delivered in the background instead of
+# being awaited before the next LLM call.
+FIRE_AND_FORGET_TOOLS = {'send-email', 'refresh_canvas'}
+outbox_concurrency = 4
+outbox_max_retries = 2
+
+# Learned tool-transition statistics drive speculative execution of the
+# most likely side-effect-free next call while the LLM is deciding
+transition_stats = TransitionStats()
+
+# Learned tool-call templates replayed without calling the LLM
+workflow_cache = WorkflowCache()
+
+# Every LLM call is admitted by one shared limiter: token buckets for the
+# requests/tokens-per-minute quota, an AIMD concurrency limit that halves on
+# 429s/timeouts, and priority lanes so interactive queries overtake batch ones
+llm_limiter = AdaptiveLimiter(
+    requests_per_minute=float(os.getenv("LLM_RPM", "60")),
+    tokens_per_minute=float(os.getenv("LLM_TPM", "1000000")),
+    initial_concurrency=float(os.getenv("LLM_CONCURRENCY", "4")),
+    max_concurrency=float(os.getenv("LLM_MAX_CONCURRENCY", "16")),
+)
+llm_max_retries = int(os.getenv("LLM_MAX_RETRIES", "3"))
+llm_retry_backoff = 1.0  # seconds, doubled on each throttled retry
+
+# Append-only journal of every run, so a crashed query can be resumed without
+# repeating LLM calls or side effects; pure tools are safe to run again
+journal = RunJournal()
+IDEMPOTENT_TOOLS = SIDE_EFFECT_FREE_TOOLS
 
-# Global sessions for both MCP servers
+# Global sessions for both MCP servers, shared by every query
 math_session = None
 gmail_session = None
+tools = []
+list_result_tools = set()  # tools declaring a list result, so one-item lists stay lists
+system_prompt = ""
+llm_config = None  # GenerateContentConfig with function declarations in native mode
+
+# Query whose tool calls are running; sent in the request _meta so servers can
+# label their profiles per query. Speculation and outbox tasks inherit it.
+current_query_id = contextvars.ContextVar("current_query_id", default=None)
+# Older MCP SDKs can't attach _meta to call_tool
+CALL_TOOL_META = "meta" in inspect.signature(ClientSession.call_tool).parameters
+
+# One circuit breaker per MCP server; an open breaker fails calls fast
+breakers = {"math": CircuitBreaker("math"), "gmail": CircuitBreaker("gmail")}
+
+# Gmail tools: send-email, get-unread-emails, read-email, trash-email, mark-email-as-read, open-email
+GMAIL_TOOL_NAMES = ['send-email', 'get-unread-emails', 'read-email', 'trash-email',
+                    'mark-email-as-read', 'open-email']
+
+async def generate_with_timeout(client, prompt, timeout=10, config=None, priority="interactive"):
+    """Generate content with a timeout, admitted by the shared rate limiter.
+
+    429 RESOURCE_EXHAUSTED responses are retried with exponential backoff;
+    every throttle or timeout also shrinks the limiter's concurrency window.
+    """
+    estimated_tokens = len(prompt) // 4 + 1
+    for attempt in range(llm_max_retries + 1):
+        await llm_limiter.acquire(estimated_tokens, priority)
+        print("Starting LLM generation...")
+        outcome = "error"
+        try:
+            # Convert the synchronous generate_content call to run in a thread
+            loop = asyncio.get_event_loop()
+            response = await asyncio.wait_for(
+                loop.run_in_executor(
+                    None, 
+                    lambda: client.models.generate_content(
+                        model="gemini-2.0-flash",
+                        contents=prompt,
+                        config=config
+                    )
+                ),
+                timeout=timeout
+            )
+            outcome = "success"
+            print("LLM generation completed")
+            return response
+        except TimeoutError:
+            outcome = "timeout"
+            print("LLM generation timed out!")
+            raise
+        except Exception as e:
+            if not is_throttled(e) or attempt == llm_max_retries:
+                print(f"Error in LLM generation: {e}")
+                raise
+            outcome = "throttled"
+        finally:
+            await llm_limiter.release(outcome)
+        delay = llm_retry_backoff * 2 ** attempt
+        print(f"LLM throttled (429), retrying in {delay:.1f}s")
+        await asyncio.sleep(delay)
 
-async def generate_with_timeout(client, prompt, timeout=10):
-    """Generate content with a timeout"""
-    print("Starting LLM generation...")
+def get_session_for_tool(func_name):
+    """Route a tool call to the MCP session that serves it"""
+    if func_name in GMAIL_TOOL_NAMES:
+        print(f"DEBUG: Routing to Gmail session")
+        return gmail_session
+    print(f"DEBUG: Routing to Math session")
+    return math_session
+
+async def cancel_request(session, request_id, reason):
+    """Tell the server to stop working on a request we gave up on"""
+    if request_id is None:
+        return
     try:
-        # Convert the synchronous generate_content call to run in a thread
-        loop = asyncio.get_event_loop()
-        response = await asyncio.wait_for(
-            loop.run_in_executor(
-                None, 
-                lambda: client.models.generate_content(
-                    model="gemini-2.0-flash",
-                    contents=prompt
-                )
-            ),
-            timeout=timeout
-        )
-        print("LLM generation completed")
-        return response
-    except TimeoutError:
-        print("LLM generation timed out!")
-        raise
+        await session.send_notification(types.ClientNotification(types.CancelledNotification(
+            method="notifications/cancelled",
+            params=types.CancelledNotificationParams(requestId=request_id, reason=reason),
+        )))
     except Exception as e:
-        print(f"Error in LLM generation: {e}")
-        raise
+        print(f"DEBUG: Could not send cancellation for request {request_id}: {e}")
 
-def reset_state():
-    """Reset all global variables to their initial state"""
-    global last_response, iteration, iteration_response
-    last_response = None
-    iteration = 0
-    iteration_response = []
+async def call_tool(session, func_name, arguments):
+    """Call a tool with a timeout, behind its server's circuit breaker.
+
+    Large numeric lists are packed for the math server if enabled. A call
+    that times out (or is cancelled, e.g. discarded speculation) is
+    cancelled on the server too.
+    """
+    server = "gmail" if session is gmail_session and session is not None else "math"
+    breaker = breakers[server]
+    breaker.before_call()
+    if session is math_session:
+        arguments = pack_arguments(arguments)
+    timeout = call_timeout(server, func_name)
+    request_id = None
+
+    async def send():
+        nonlocal request_id
+        # ClientSession numbers requests sequentially; this call gets the next id
+        request_id = getattr(session, "_request_id", None)
+        query_id = current_query_id.get()
+        if CALL_TOOL_META and query_id is not None:
+            return await session.call_tool(func_name, arguments=arguments, meta={"query_id": query_id})
+        return await session.call_tool(func_name, arguments=arguments)
 
-async def main():
-    reset_state()  # Reset at the start of main
-    print("Starting main execution...")
-    
-    global math_session, gmail_session
-    
     try:
-        # Create MCP server connections for BOTH math and gmail servers
-        print("Establishing connection to Math MCP server...")
-        math_server_params = StdioServerParameters(
-            command="python3",
-            args=["example_macp_server_mac.py"]
-        )
-        
-        print("Establishing connection to Gmail MCP server...")
-        gmail_server_params = StdioServerParameters(
-            command="python3",
-            args=[
-                "/Users/rishikesh.kumar/Desktop/EAGV2/gmail-mcp-server/src/gmail/server.py",
-                "--creds-file-path",
-                "/Users/rishikesh.kumar/Desktop/EAGV2/gmail-mcp-server/src/.google/client_creds.json",
-                "--token-path",
-                "/Users/rishikesh.kumar/Desktop/EAGV2/gmail-mcp-server/src/.google/app_tokens.json"
+        result = await asyncio.wait_for(send(), timeout)
+    except asyncio.TimeoutError:
+        breaker.record_failure(timeout=True)
+        reason = f"{func_name} timed out after {timeout:.0f}s"
+        await cancel_request(session, request_id, reason)
+        raise ToolTimeoutError(reason) from None
+    except asyncio.CancelledError:
+        breaker.record_cancelled()
+        await cancel_request(session, request_id, "cancelled by client")
+        raise
+    except Exception:
+        breaker.record_failure()
+        raise
+    breaker.record_success()
+    return result
+
+def extract_result(result):
+    """Get the full result content of a tool call as text.
+
+    A packed numeric list (see packed_arrays.py) is decoded straight into an
+    array.array (a NumPy view with MCP_PACKED_NUMPY=1) instead of a list of
+    strings.
+    """
+    if hasattr(result, 'content'):
+        # Handle multiple content items
+        if isinstance(result.content, list):
+            if len(result.content) == 1 and hasattr(result.content[0], 'text'):
+                values = unpack_text(result.content[0].text, as_numpy=numpy_enabled())
+                if values is not None:
+                    return values
+            return [
+                item.text if hasattr(item, 'text') else str(item)
+                for item in result.content
             ]
-        )
+        return str(result.content)
+    return str(result)
+
+# JSON Schema keys Gemini function declarations understand
+_GEMINI_SCHEMA_KEYS = {'type', 'description', 'properties', 'required', 'items', 'enum', 'format', 'nullable'}
+
+def to_gemini_schema(schema):
+    """Strip an MCP input schema down to what Gemini accepts"""
+    cleaned = {k: v for k, v in schema.items() if k in _GEMINI_SCHEMA_KEYS}
+    if 'properties' in cleaned:
+        cleaned['properties'] = {name: to_gemini_schema(prop) for name, prop in cleaned['properties'].items()}
+    if cleaned.get('type') == 'array':
+        # Untyped `list` parameters come through as items: {}
+        cleaned['items'] = to_gemini_schema(cleaned.get('items') or {}) or {'type': 'number'}
+        if 'type' not in cleaned['items']:
+            cleaned['items']['type'] = 'number'
+    if cleaned.get('type') == 'object' and not cleaned.get('properties'):
+        # Gemini rejects objects without properties; a no-argument tool has no schema
+        return {}
+    return cleaned
 
-        # Connect to both servers
-        async with stdio_client(math_server_params) as (math_read, math_write), \
-                   stdio_client(gmail_server_params) as (gmail_read, gmail_write):
-            print("Connections established, creating sessions...")
+def build_function_declarations(tools):
+    """Turn the MCP tool list into Gemini function declarations"""
+    declarations = []
+    for tool in tools:
+        parameters = to_gemini_schema(tool.inputSchema or {})
+        declarations.append(genai_types.FunctionDeclaration(
+            name=tool.name,
+            description=getattr(tool, 'description', None) or tool.name,
+            parameters=parameters or None,
+        ))
+    return declarations
+
+def _coerce(value, schema):
+    """Coerce a structured argument to the type its schema asks for"""
+    param_type = schema.get('type', 'string')
+    if param_type == 'integer':
+        return int(value)
+    if param_type == 'number':
+        return float(value)
+    if param_type == 'array':
+        if isinstance(value, str):
+            value = [x for x in value.strip('[]').split(',') if x.strip()]
+        items = schema.get('items') or {}
+        if items.get('type') in ('integer', 'number', 'string'):
+            return [_coerce(x, items) for x in value]
+        # Untyped lists: keep whole numbers as ints like the text protocol does
+        return [int(float(x)) if float(x).is_integer() else float(x) for x in value]
+    if param_type == 'string':
+        return str(value)
+    return value
+
+def native_arguments(tool, args):
+    """Arguments of a structured function call, typed per the tool's schema"""
+    schema_properties = tool.inputSchema.get('properties', {})
+    missing = [name for name in tool.inputSchema.get('required', []) if name not in args]
+    if missing:
+        raise ValueError(f"Missing parameters for {tool.name}: {', '.join(missing)}")
+    return {
+        name: _coerce(value, schema_properties.get(name, {}))
+        for name, value in args.items()
+        if name in schema_properties
+    }
+
+def text_arguments(tool, func_name, params):
+    """Map pipe-delimited FUNCTION_CALL parameters onto the tool's input schema"""
+    # Prepare arguments according to the tool's input schema
+    arguments = {}
+    schema_properties = tool.inputSchema.get('properties', {})
+    print(f"DEBUG: Schema properties: {schema_properties}")
+
+    required = tool.inputSchema.get('required', list(schema_properties))
+    for param_name, param_info in schema_properties.items():
+        if not params:  # Check if we have enough parameters
+            if param_name not in required:
+                break  # Trailing optional parameters keep their defaults
+            raise ValueError(f"Not enough parameters provided for {func_name}")
             
-            async with ClientSession(math_read, math_write) as math_sess, \
-                       ClientSession(gmail_read, gmail_write) as gmail_sess:
-                print("Sessions created, initializing...")
-                
-                # Store sessions globally so we can route tool calls
-                math_session = math_sess
-                gmail_session = gmail_sess
-                
-                await math_session.initialize()
-                await gmail_session.initialize()
-                
-                # Get available tools from BOTH servers
-                print("Requesting tool lists from both servers...")
-                math_tools_result = await math_session.list_tools()
-                gmail_tools_result = await gmail_session.list_tools()
-                
-                math_tools = math_tools_result.tools
-                gmail_tools = gmail_tools_result.tools
-                
-                # Merge tools from both servers
-                tools = list(math_tools) + list(gmail_tools)
-                print(f"Successfully retrieved {len(math_tools)} math tools and {len(gmail_tools)} gmail tools")
-                print(f"Total tools available: {len(tools)}")
-
-                # Create system prompt with available tools
-                print("Creating system prompt...")
-                print(f"Number of tools: {len(tools)}")
-                
-                try:
-                    # First, let's inspect what a tool object looks like
-                    # if tools:
-                    #     print(f"First tool properties: {dir(tools[0])}")
-                    #     print(f"First tool example: {tools[0]}")
-                    
-                    tools_description = []
-                    for i, tool in enumerate(tools):
-                        try:
-                            # Get tool properties
-                            params = tool.inputSchema
-                            desc = getattr(tool, 'description', 'No description available')
-                            name = getattr(tool, 'name', f'tool_{i}')
-                            
-                            # Format the input schema in a more readable way
-                            if 'properties' in params:
-                                param_details = []
-                                for param_name, param_info in params['properties'].items():
-                                    param_type = param_info.get('type', 'unknown')
-                                    param_details.append(f"{param_name}: {param_type}")
-                                params_str = ', '.join(param_details)
-                            else:
-                                params_str = 'no parameters'
-
-                            tool_desc = f"{i+1}. {name}({params_str}) - {desc}"
-                            tools_description.append(tool_desc)
-                            print(f"Added description for tool: {tool_desc}")
-                        except Exception as e:
-                            print(f"Error processing tool {i}: {e}")
-                            tools_description.append(f"{i+1}. Error processing tool")
-                    
-                    tools_description = "\n".join(tools_description)
-                    print("Successfully created tools description")
-                except Exception as e:
-                    print(f"Error creating tools description: {e}")
-                    tools_description = "Error loading tools"
-                
-                print("Created system prompt...")
+        value = params.pop(0)  # Get and remove the first parameter
+        param_type = param_info.get('type', 'string')
+        
+        print(f"DEBUG: Converting parameter {param_name} with value {value} to type {param_type}")
+        
+        # Convert the value to the correct type based on the schema
+        if param_type == 'integer':
+            arguments[param_name] = int(value)
+        elif param_type == 'number':
+            arguments[param_name] = float(value)
+        elif param_type == 'array':
+            # Handle array input
+            if isinstance(value, str):
+                value = value.strip('[]').split(',')
+            arguments[param_name] = [int(x.strip()) for x in value]
+        else:
+            arguments[param_name] = str(value)
+    return arguments
+
+@dataclass
+class QueryState:
+    """Per-query agent state, so concurrent queries don't share anything"""
+    query: str
+    iteration: int = 0
+    last_response: object = None
+    iteration_response: list = field(default_factory=list)
+    trace: list = field(default_factory=list)
+    final_answer: Optional[str] = None
+
+def _no_events(event, **data):
+    pass
+
+def build_tools_description(tools):
+    """Describe the available tools for the system prompt"""
+    try:
+        # First, let's inspect what a tool object looks like
+        # if tools:
+        #     print(f"First tool properties: {dir(tools[0])}")
+        #     print(f"First tool example: {tools[0]}")
+        
+        tools_description = []
+        for i, tool in enumerate(tools):
+            try:
+                # Get tool properties
+                params = tool.inputSchema
+                desc = getattr(tool, 'description', 'No description available')
+                name = getattr(tool, 'name', f'tool_{i}')
                 
-                system_prompt = f"""You are a math agent that solves problems. You have access to mathematical, canvas drawing, and email tools.
+                # Format the input schema in a more readable way
+                if 'properties' in params:
+                    param_details = []
+                    for param_name, param_info in params['properties'].items():
+                        param_type = param_info.get('type', 'unknown')
+                        param_details.append(f"{param_name}: {param_type}")
+                    params_str = ', '.join(param_details)
+                else:
+                    params_str = 'no parameters'
+
+                tool_desc = f"{i+1}. {name}({params_str}) - {desc}"
+                tools_description.append(tool_desc)
+                print(f"Added description for tool: {tool_desc}")
+            except Exception as e:
+                print(f"Error processing tool {i}: {e}")
+                tools_description.append(f"{i+1}. Error processing tool")
+        
+        tools_description = "\n".join(tools_description)
+        print("Successfully created tools description")
+    except Exception as e:
+        print(f"Error creating tools description: {e}")
+        tools_description = "Error loading tools"
+    return tools_description
+
+def build_system_prompt(tools_description, native=False):
+    """Create the system prompt for the available tools"""
+    if native:
+        return f"""You are a math agent that solves problems. You have access to mathematical, canvas drawing, and email tools.
+
+Available tools:
+{tools_description}
+
+Use the provided functions to call tools, exactly one function call per response.
+When the task is complete, respond with EXACTLY ONE line and no function call:
+   FINAL_ANSWER: [your_result]
+
+WORKFLOW:
+1. Solve the mathematical problem using math tools
+2. IF the user asks to "visualize", "draw", "show on canvas", or "paint", then:
+   - Open canvas using open_canvas
+   - Draw rectangle using draw_rectangle with coordinates (e.g., x1=100, y1=100, x2=600, y2=200)
+   - Add text with result using add_text_in_paint (text_x=110, text_y=110, text="your answer")
+   - Refresh canvas using refresh_canvas to display
+3. IF the user asks to "send email", "email the result", or "notify via email", then:
+   - Use send-email tool with recipient_id, subject, and message containing your final answer
+4. Return FINAL_ANSWER with your result
+
+Important Rules:
+- ONLY use canvas tools if user specifically requests visualization/drawing/canvas
+- ONLY use email tools if user specifically requests sending email
+- If no visualization or email requested, return FINAL_ANSWER immediately after calculations
+- Canvas workflow when needed: open_canvas → draw_rectangle → add_text_in_paint → refresh_canvas
+- Text position should be inside rectangle bounds (add ~10px padding from rectangle x1, y1)
+- Include your calculated result in the text parameter
+- Do not repeat function calls with the same parameters
+- For arithmetic with several operations, make ONE evaluate call with the whole expression
+  instead of chaining add/subtract/multiply/divide/sqrt/... calls; bind earlier results as variables
+- For several independent tool calls you already know you need (e.g. sin, cos and tan of one value),
+  make ONE call_many call with a JSON array of {{"tool": ..., "arguments": {{...}}}} entries
+- Pass lists (e.g. int_list) as arrays of numbers, not as strings
+
+DO NOT include any explanations or additional text."""
+
+    system_prompt = f"""You are a math agent that solves problems. You have access to mathematical, canvas drawing, and email tools.
 
 Available tools:
 {tools_description}
@@ -184,6 +440,10 @@ Important Rules:
 - Text position should be inside rectangle bounds (add ~10px padding from rectangle x1, y1)
 - Include your calculated result in the text parameter
 - Do not repeat function calls with the same parameters
+- For arithmetic with several operations, make ONE evaluate call with the whole expression
+  instead of chaining add/subtract/multiply/divide/sqrt/... calls; bind earlier results as variables
+- For several independent tool calls you already know you need (e.g. sin, cos and tan of one value),
+  make ONE call_many call with a JSON array of {{"tool": ..., "arguments": {{...}}}} entries
 - For send-email, use format: send-email|recipient@email.com|Subject Line|Message body with result
 
 Examples WITHOUT visualization or email:
@@ -191,6 +451,13 @@ Examples WITHOUT visualization or email:
 - FUNCTION_CALL: int_list_to_exponential_sum|73,78,68,73,65
 - FINAL_ANSWER: [8.599e+33]
 
+Example of a whole-expression calculation:
+- FUNCTION_CALL: evaluate|(a+b)*c - sqrt(d)|a=3, b=4, c=5, d=16
+- FINAL_ANSWER: [31.0]
+
+Example of batching independent calls in one round trip:
+- FUNCTION_CALL: call_many|[{{"tool": "sin", "arguments": {{"a": 1}}}}, {{"tool": "cos", "arguments": {{"a": 1}}}}]|concurrent
+
 Examples WITH email (if user asks):
 - FUNCTION_CALL: strings_to_chars_to_int|RISHIKESH
 - FUNCTION_CALL: int_list_to_exponential_sum|82,73,83,72,73,75,69,83,72
@@ -199,202 +466,551 @@ Examples WITH email (if user asks):
 
 DO NOT include any explanations or additional text.
 Your entire response should be a single line starting with either FUNCTION_CALL: or FINAL_ANSWER:"""
+    return system_prompt
+
+# Settings passed on to the math server we spawn (stdio servers otherwise only
+# get a minimal default environment)
+FORWARDED_SERVER_ENV = ("MCP_PACKED_ARRAYS", "MCP_PACK_THRESHOLD", "MCP_PROFILE", "MCP_PROFILE_DIR",
+                        "MCP_PROFILE_INTERVAL")
+
+def forwarded_server_env():
+    return {name: os.environ[name] for name in FORWARDED_SERVER_ENV if os.getenv(name)}
+
+def math_server_env():
+    """Environment for the math server, or None for the MCP default"""
+    forwarded = forwarded_server_env()
+    if not forwarded:
+        return None
+    return {**get_default_environment(), **forwarded}
+
+async def start_servers(stack):
+    """Spawn both MCP servers, open sessions and load the tool registry.
+
+    The servers live as long as `stack` (an AsyncExitStack); sessions, tools
+    and the system prompt are stored globally so every query can share them.
+    """
+    global math_session, gmail_session, tools, list_result_tools, system_prompt, llm_config
+
+    # Create MCP server connections for BOTH math and gmail servers
+    print("Establishing connection to Math MCP server...")
+    math_server_params = StdioServerParameters(
+        command="python3",
+        args=["example_macp_server_mac.py"],
+        env=math_server_env()
+    )
+    record_path = os.getenv("MCP_RECORD")
+    if record_path:
+        # Route the math server through the recording proxy for mcp_loadgen.py replay
+        print(f"Recording Math MCP JSON-RPC traffic to {record_path}")
+        math_server_params = StdioServerParameters(
+            command="python3",
+            args=["mcp_loadgen.py", "proxy", "--out", record_path, "--",
+                  math_server_params.command, *math_server_params.args],
+            env=math_server_params.env
+        )
+    
+    print("Establishing connection to Gmail MCP server...")
+    gmail_server_params = StdioServerParameters(
+        command="python3",
+        args=[
+            "/Users/rishikesh.kumar/Desktop/EAGV2/gmail-mcp-server/src/gmail/server.py",
+            "--creds-file-path",
+            "/Users/rishikesh.kumar/Desktop/EAGV2/gmail-mcp-server/src/.google/client_creds.json",
+            "--token-path",
+            "/Users/rishikesh.kumar/Desktop/EAGV2/gmail-mcp-server/src/.google/app_tokens.json"
+        ]
+    )
 
-                # Interactive Query Loop
-                print("\n" + "="*70)
-                print("🤖 AGENTIC AI ASSISTANT - Interactive Mode")
-                print("="*70)
-                print("\nCapabilities:")
-                print("  • Mathematical calculations (ASCII, exponentials, etc.)")
-                print("  • Canvas visualization")
-                print("  • Email results via Gmail")
-                print("\nExamples:")
-                print('  "Calculate ASCII sum for HELLO"')
-                print('  "Calculate ASCII sum for WORLD and visualize it"')
-                print('  "Calculate ASCII sum for AI and email to me@example.com"')
-                print("\nType 'quit', 'exit', or 'q' to stop.\n")
-                print("="*70 + "\n")
+    # Connect to both servers. MCP_FORK_SERVER=<socket> forks the math server
+    # from a warm template (fork_server.py) instead of cold-starting it
+    math_session = None
+    fork_socket = os.getenv("MCP_FORK_SERVER")
+    if fork_socket and not record_path:
+        if await asyncio.to_thread(fork_server.ensure_running, fork_socket):
+            # A forked child can also die after connecting, so the handshake
+            # is part of the attempt; any failure falls back to a cold start
+            fork_stack = AsyncExitStack()
+            try:
+                math_read, math_write = await fork_stack.enter_async_context(
+                    fork_server.fork_client(fork_socket, forwarded_server_env()))
+                session = await fork_stack.enter_async_context(ClientSession(math_read, math_write))
+                await session.initialize()
+                math_tools_result = await session.list_tools()
+            except Exception as e:
+                print(f"⚠️  Fork server unavailable ({e!r}), cold-starting the Math MCP server")
+                with suppress(Exception):
+                    await fork_stack.aclose()
+            else:
+                await stack.enter_async_context(fork_stack)
+                math_session = session
+                print(f"Math MCP server forked from the warm template on {fork_socket}")
+        else:
+            print(f"⚠️  Could not start the fork server on {fork_socket}, cold-starting the Math MCP server")
+    if math_session is None:
+        math_read, math_write = await stack.enter_async_context(stdio_client(math_server_params))
+        math_session = await stack.enter_async_context(ClientSession(math_read, math_write))
+        await math_session.initialize()
+        math_tools_result = await math_session.list_tools()
+    gmail_read, gmail_write = await stack.enter_async_context(stdio_client(gmail_server_params))
+    print("Connections established, creating sessions...")
+    
+    # Store sessions globally so we can route tool calls
+    gmail_session = await stack.enter_async_context(ClientSession(gmail_read, gmail_write))
+    print("Sessions created, initializing...")
+    
+    await gmail_session.initialize()
+    
+    # Get available tools from BOTH servers
+    print("Requesting tool lists from both servers...")
+    gmail_tools_result = await gmail_session.list_tools()
+    
+    math_tools = math_tools_result.tools
+    gmail_tools = gmail_tools_result.tools
+    
+    # Merge tools from both servers
+    tools = list(math_tools) + list(gmail_tools)
+    print(f"Successfully retrieved {len(math_tools)} math tools and {len(gmail_tools)} gmail tools")
+    print(f"Total tools available: {len(tools)}")
+    list_result_tools = {tool.name for tool in tools if returns_list(tool)}
+    workflow_cache.set_tools(tools)
+
+    # Create system prompt with available tools
+    print("Creating system prompt...")
+    print(f"Number of tools: {len(tools)}")
+    system_prompt = build_system_prompt(build_tools_description(tools), native=llm_protocol == "native")
+    print("Created system prompt...")
+
+    if llm_protocol == "native":
+        llm_config = genai_types.GenerateContentConfig(
+            tools=[genai_types.Tool(function_declarations=build_function_declarations(tools))],
+            automatic_function_calling=genai_types.AutomaticFunctionCallingConfig(disable=True),
+        )
+        print(f"Using native function calling with {len(tools)} function declarations")
+    else:
+        llm_config = None
+        print("Using text FUNCTION_CALL protocol")
+
+async def run_query(query, emit=_no_events, query_id=None, priority="interactive", resume=None):
+    """Run one query through the agent and return its final answer (or None).
+
+    Progress is reported through `emit(event, **data)` so callers such as the
+    daemon can stream it; all state lives in a QueryState local to this call.
+    `priority` ("interactive" or "batch") picks the rate limiter lane for its
+    LLM calls. Every step is written to the run journal under a run id that
+    is unique to this call (`query_id` is caller-chosen and can repeat across
+    runs, so it is only recorded alongside); pass a ResumeLog as `resume` to
+    continue a crashed run under its original run id.
+    """
+    query_id = query_id or uuid.uuid4().hex[:8]
+    run_id = resume.run if resume is not None else f"{query_id}-{uuid.uuid4().hex[:8]}"
+    token = current_query_id.set(query_id)
+    try:
+        with profiling.labelled(f"query-{query_id}"):
+            return await _run_query(query, emit, query_id, run_id, priority, resume)
+    finally:
+        current_query_id.reset(token)
+
+def journaled_call(run_id, iteration, session, func_name, arguments):
+    """Outbox delivery that journals its side effect at most once"""
+    started = False
+
+    async def call():
+        nonlocal started
+        if not started:
+            await journal.append_durable(run_id, "tool_started", iteration=iteration,
+                                         tool=func_name, arguments=arguments)
+            started = True
+        result = await call_tool(session, func_name, arguments)
+        if not getattr(result, 'isError', False):
+            journal.append(run_id, "delivered", iteration=iteration, tool=func_name, ok=True)
+        return result
+    return call
+
+async def _run_query(query, emit, query_id, run_id, priority, resume):
+    state = QueryState(query=query)
+    outbox = Outbox(concurrency=outbox_concurrency, max_retries=outbox_max_retries)
+    speculator = Speculator(transition_stats)
+    guard = LoopGuard(query, max_iterations, max_stalled_iterations, native=llm_protocol == "native")
+    emit("start", query=query, query_id=query_id, run_id=run_id, budget=guard.budget)
+    current_query = query
+    if resume is None:
+        journal.append(run_id, "start", query=query, query_id=query_id)
+        if journal.enabled:
+            print(f"🧾 Journaling run {run_id}")
+    else:
+        print(f"🧾 Resuming run {run_id} from the journal")
+
+    # Try a learned workflow before spending any LLM calls
+    replay_iteration = 0
+
+    async def replay_step(func_name, arguments):
+        nonlocal replay_iteration
+        iteration, replay_iteration = replay_iteration, replay_iteration + 1
+        session = get_session_for_tool(func_name)
+        if func_name in FIRE_AND_FORGET_TOOLS:
+            journal.append(run_id, "queued", iteration=iteration, tool=func_name, arguments=arguments)
+            outbox.submit(func_name, arguments,
+                          journaled_call(run_id, iteration, session, func_name, arguments))
+            return None
+        if func_name not in IDEMPOTENT_TOOLS:
+            await journal.append_durable(run_id, "tool_started", iteration=iteration,
+                                         tool=func_name, arguments=arguments)
+        result = await call_tool(session, func_name, arguments)
+        if getattr(result, 'isError', False):
+            raise RuntimeError(result_text(extract_result(result)))
+        journal.append(run_id, "tool_done", iteration=iteration, tool=func_name,
+                       arguments=arguments, result=extract_result(result))
+        return extract_result(result)
+
+    # A resumed run follows its journal instead
+    replay = None if resume is not None else await workflow_cache.replay(query, replay_step)
+    replayed = replay is not None and "final_answer" in replay
+    if replay is not None:
+        for step in replay["completed"]:
+            if step["result"] is None:
+                outcome = "it was queued for background delivery"
+            else:
+                outcome = f"the function returned [{result_text(step['result'])}]"
+            state.iteration_response.append(
+                f"In the {state.iteration + 1} iteration you called {step['tool']} with "
+                f"{step['arguments']} parameters, and {outcome}."
+            )
+            state.trace.append(step)
+            guard.record(step["tool"], step["arguments"], state.iteration + 1, outcome)
+            state.last_response = step["result"] if step["result"] is not None else f"{step['tool']} queued"
+            state.iteration += 1
+            emit("tool_result", tool=step["tool"], arguments=step["arguments"], result=step["result"], replayed=True)
+        if replayed:
+            state.final_answer = replay["final_answer"]
+            journal.append(run_id, "final", answer=state.final_answer)
+            print("\n" + "="*70)
+            print("✅ QUERY COMPLETE (replayed cached workflow)")
+            print("="*70)
+            print(f"Final Answer: {state.final_answer}")
+            print("="*70)
+        else:
+            print(f"⚠️  {replay['error']} - falling back to the LLM")
+            state.iteration_response.append(f"Error in iteration {state.iteration + 1}: {replay['error']}")
+
+    while not replayed and state.iteration < guard.budget:
+        print(f"\n--- Iteration {state.iteration + 1} ---")
+        emit("iteration", iteration=state.iteration + 1)
+        if state.last_response is not None:
+            current_query = current_query + "\n\n" + " ".join(state.iteration_response)
+            current_query = current_query + "  What should I do next?"
+
+        # Get model's response with timeout
+        print("Preparing to generate LLM response...")
+        prompt = f"{system_prompt}\n\nQuery: {current_query}"
+
+        digest = prompt_hash(prompt)
+        journaled = resume.llm_response(state.iteration, digest) if resume is not None else None
+        if journaled is None:
+            # Run the likely next pure call while the LLM decides
+            speculator.speculate(
+                lambda name, args: call_tool(math_session, name, args)
+            )
+        try:
+            if journaled is not None:
+                # Same prompt as before the crash: reuse the model's decision
+                call = journaled["call"]
+                function_call = SimpleNamespace(name=call["name"], args=call["args"]) if call else None
+                response_text = journaled["text"]
+                print(f"LLM Response (from journal): {response_text}")
+            else:
+                response = await generate_with_timeout(client, prompt, config=llm_config, priority=priority)
+                function_calls = getattr(response, 'function_calls', None) if llm_config else None
+                if function_calls:
+                    # Structured call: no text parsing needed
+                    function_call = function_calls[0]
+                    response_text = f"FUNCTION_CALL: {function_call.name}"
+                    print(f"LLM Function Call: {function_call.name}({dict(function_call.args or {})})")
+                else:
+                    function_call = None
+                    response_text = (response.text or "").strip()
+                    print(f"LLM Response: {response_text}")
                 
-                while True:
-                    # Get query from user
-                    try:
-                        query = input("\n💬 Your Query: ").strip()
-                    except (EOFError, KeyboardInterrupt):
-                        print("\n\n👋 Goodbye!")
-                        break
-                    
-                    if not query:
-                        print("⚠️  Please enter a query.")
-                        continue
-                    
-                    if query.lower() in ['quit', 'exit', 'q']:
-                        print("\n👋 Goodbye!")
+                    # Find the FUNCTION_CALL or FINAL_ANSWER line in the response
+                    for line in response_text.split('\n'):
+                        line = line.strip()
+                        if line.startswith("FUNCTION_CALL:") or line.startswith("FINAL_ANSWER:"):
+                            response_text = line
+                            print(f"Extracted command: {response_text}")
+                            break
+                call = None
+                if function_call is not None:
+                    call = {"name": function_call.name, "args": dict(function_call.args or {})}
+                journal.append(run_id, "llm", iteration=state.iteration, prompt_hash=digest,
+                               text=response_text, call=call)
+            
+        except Exception as e:
+            print(f"Failed to get LLM response: {e}")
+            emit("error", message=f"Failed to get LLM response: {e}")
+            break
+
+        emit("llm_response", text=response_text)
+
+        if response_text.startswith("FUNCTION_CALL:"):
+            if function_call is not None:
+                func_name, params = function_call.name, dict(function_call.args or {})
+            else:
+                _, function_info = response_text.split(":", 1)
+                parts = [p.strip() for p in function_info.split("|")]
+                func_name, params = parts[0], parts[1:]
+                print(f"\nDEBUG: Raw function info: {function_info}")
+                print(f"DEBUG: Split parts: {parts}")
+            
+            print(f"DEBUG: Function name: {func_name}")
+            print(f"DEBUG: Raw parameters: {params}")
+            
+            try:
+                # Find the matching tool to get its input schema
+                tool = next((t for t in tools if t.name == func_name), None)
+                if not tool:
+                    print(f"DEBUG: Available tools: {[t.name for t in tools]}")
+                    raise ValueError(f"Unknown tool: {func_name}")
+
+                print(f"DEBUG: Found tool: {tool.name}")
+                print(f"DEBUG: Tool schema: {tool.inputSchema}")
+
+                # Determine which session to use based on tool name
+                active_session = get_session_for_tool(func_name)
+
+                if function_call is not None:
+                    arguments = native_arguments(tool, params)
+                else:
+                    arguments = text_arguments(tool, func_name, params)
+
+                print(f"DEBUG: Final arguments: {arguments}")
+
+                # Answer repeated calls from the earlier result instead of re-executing
+                nudge = guard.check_repeat(func_name, arguments)
+                if nudge is not None:
+                    print(f"DEBUG: Repeated call to {func_name}, not re-executing")
+                    state.iteration_response.append(nudge)
+                    emit("repeat", tool=func_name, arguments=arguments)
+                    state.iteration += 1
+                    if guard.should_stop:
                         break
+                    continue
+
+                emit("tool_call", tool=func_name, arguments=arguments)
+                journaled = resume.tool_outcome(state.iteration, func_name, arguments) if resume is not None else None
+
+                if func_name in FIRE_AND_FORGET_TOOLS:
+                    if journaled is not None and journaled.keys() & {"tool_started", "delivered"}:
+                        # Already delivered (or attempted) before the crash: at most once
+                        print(f"DEBUG: {func_name} was delivered before the crash, not repeating it")
+                        delivery = SimpleNamespace(id="journal")
+                    else:
+                        # Don't block the next LLM call on a terminal side effect
+                        if journaled is None:
+                            journal.append(run_id, "queued", iteration=state.iteration,
+                                           tool=func_name, arguments=arguments)
+                        delivery = outbox.submit(
+                            func_name, arguments,
+                            journaled_call(run_id, state.iteration, active_session, func_name, arguments)
+                        )
+                        print(f"DEBUG: Queued {func_name} for background delivery (#{delivery.id})")
+                    state.iteration_response.append(
+                        f"In the {state.iteration + 1} iteration you called {func_name} with {arguments} parameters, "
+                        f"and it was queued for background delivery."
+                    )
+                    state.last_response = f"{func_name} queued"
+                    speculator.observe(func_name, arguments, None)
+                    state.trace.append({"tool": func_name, "arguments": arguments, "result": None})
+                    guard.record(func_name, arguments, state.iteration + 1, "queued for background delivery")
+                    emit("queued", tool=func_name, delivery=delivery.id)
+                    state.iteration += 1
+                    continue
+
+                if journaled is not None and "tool_done" in journaled:
+                    iteration_result = journaled["tool_done"]["result"]
+                    print(f"DEBUG: Using journaled result for {func_name}")
+                elif journaled is not None:
+                    # Started before the crash with no recorded outcome: never run it twice
+                    iteration_result = f"{func_name} had already been started before a crash and was not repeated"
+                    print(f"DEBUG: {iteration_result}")
+                else:
+                    if func_name not in IDEMPOTENT_TOOLS:
+                        await journal.append_durable(run_id, "tool_started", iteration=state.iteration,
+                                                     tool=func_name, arguments=arguments)
+                    result = await speculator.claim(func_name, arguments)
+                    if result is not None:
+                        print(f"DEBUG: Using speculative result for {func_name}")
+                    else:
+                        print(f"DEBUG: Calling tool {func_name} on appropriate session")
+                        result = await call_tool(active_session, func_name, arguments)
+                    print(f"DEBUG: Raw result: {result}")
                     
-                    # Reset state for new query
-                    reset_state()
-                    
-                    print(f"\n🔄 Processing: {query}")
-                    print("-" * 70)
-                    
-                    # Use global iteration variables
-                    global iteration, last_response
+                    # Get the full result content
+                    iteration_result = extract_result(result)
+                    journal.append(run_id, "tool_done", iteration=state.iteration, tool=func_name,
+                                   arguments=arguments, result=iteration_result)
+                print(f"DEBUG: Final iteration result: {iteration_result}")
+                speculator.observe(func_name, arguments,
+                                   result_value(iteration_result, func_name in list_result_tools))
+                emit("tool_result", tool=func_name, arguments=arguments, result=iteration_result)
                 
-                    while iteration < max_iterations:
-                        print(f"\n--- Iteration {iteration + 1} ---")
-                        if last_response is None:
-                            current_query = query
-                        else:
-                            current_query = current_query + "\n\n" + " ".join(iteration_response)
-                            current_query = current_query + "  What should I do next?"
-
-                        # Get model's response with timeout
-                        print("Preparing to generate LLM response...")
-                        prompt = f"{system_prompt}\n\nQuery: {current_query}"
-                        try:
-                            response = await generate_with_timeout(client, prompt)
-                            response_text = response.text.strip()
-                            print(f"LLM Response: {response_text}")
-                            
-                            # Find the FUNCTION_CALL or FINAL_ANSWER line in the response
-                            for line in response_text.split('\n'):
-                                line = line.strip()
-                                if line.startswith("FUNCTION_CALL:") or line.startswith("FINAL_ANSWER:"):
-                                    response_text = line
-                                    print(f"Extracted command: {response_text}")
-                                    break
-                            
-                        except Exception as e:
-                            print(f"Failed to get LLM response: {e}")
-                            break
+                # Format the response based on result type
+                if isinstance(iteration_result, str):
+                    result_str = iteration_result
+                else:
+                    result_str = f"[{result_text(iteration_result)}]"
+                
+                state.iteration_response.append(
+                    f"In the {state.iteration + 1} iteration you called {func_name} with {arguments} parameters, "
+                    f"and the function returned {result_str}."
+                )
+                state.last_response = iteration_result
+                state.trace.append({"tool": func_name, "arguments": arguments, "result": iteration_result})
+                guard.record(func_name, arguments, state.iteration + 1, result_str)
 
+            except Exception as e:
+                print(f"DEBUG: Error details: {str(e)}")
+                print(f"DEBUG: Error type: {type(e)}")
+                import traceback
+                traceback.print_exc()
+                state.iteration_response.append(f"Error in iteration {state.iteration + 1}: {str(e)}")
+                emit("error", message=str(e))
+                break
 
-                        if response_text.startswith("FUNCTION_CALL:"):
-                            _, function_info = response_text.split(":", 1)
-                            parts = [p.strip() for p in function_info.split("|")]
-                            func_name, params = parts[0], parts[1:]
-                            
-                            print(f"\nDEBUG: Raw function info: {function_info}")
-                            print(f"DEBUG: Split parts: {parts}")
-                            print(f"DEBUG: Function name: {func_name}")
-                            print(f"DEBUG: Raw parameters: {params}")
-                            
-                            try:
-                                # Find the matching tool to get its input schema
-                                tool = next((t for t in tools if t.name == func_name), None)
-                                if not tool:
-                                    print(f"DEBUG: Available tools: {[t.name for t in tools]}")
-                                    raise ValueError(f"Unknown tool: {func_name}")
-
-                                print(f"DEBUG: Found tool: {tool.name}")
-                                print(f"DEBUG: Tool schema: {tool.inputSchema}")
-
-                                # Determine which session to use based on tool name
-                                # Gmail tools: send-email, get-unread-emails, read-email, trash-email, mark-email-as-read, open-email
-                                gmail_tool_names = ['send-email', 'get-unread-emails', 'read-email', 'trash-email', 
-                                                   'mark-email-as-read', 'open-email']
-                                
-                                if func_name in gmail_tool_names:
-                                    active_session = gmail_session
-                                    print(f"DEBUG: Routing to Gmail session")
-                                else:
-                                    active_session = math_session
-                                    print(f"DEBUG: Routing to Math session")
-
-                                # Prepare arguments according to the tool's input schema
-                                arguments = {}
-                                schema_properties = tool.inputSchema.get('properties', {})
-                                print(f"DEBUG: Schema properties: {schema_properties}")
-
-                                for param_name, param_info in schema_properties.items():
-                                    if not params:  # Check if we have enough parameters
-                                        raise ValueError(f"Not enough parameters provided for {func_name}")
-                                        
-                                    value = params.pop(0)  # Get and remove the first parameter
-                                    param_type = param_info.get('type', 'string')
-                                    
-                                    print(f"DEBUG: Converting parameter {param_name} with value {value} to type {param_type}")
-                                    
-                                    # Convert the value to the correct type based on the schema
-                                    if param_type == 'integer':
-                                        arguments[param_name] = int(value)
-                                    elif param_type == 'number':
-                                        arguments[param_name] = float(value)
-                                    elif param_type == 'array':
-                                        # Handle array input
-                                        if isinstance(value, str):
-                                            value = value.strip('[]').split(',')
-                                        arguments[param_name] = [int(x.strip()) for x in value]
-                                    else:
-                                        arguments[param_name] = str(value)
-
-                                print(f"DEBUG: Final arguments: {arguments}")
-                                print(f"DEBUG: Calling tool {func_name} on appropriate session")
-                                
-                                result = await active_session.call_tool(func_name, arguments=arguments)
-                                print(f"DEBUG: Raw result: {result}")
-                                
-                                # Get the full result content
-                                if hasattr(result, 'content'):
-                                    print(f"DEBUG: Result has content attribute")
-                                    # Handle multiple content items
-                                    if isinstance(result.content, list):
-                                        iteration_result = [
-                                            item.text if hasattr(item, 'text') else str(item)
-                                            for item in result.content
-                                        ]
-                                    else:
-                                        iteration_result = str(result.content)
-                                else:
-                                    print(f"DEBUG: Result has no content attribute")
-                                    iteration_result = str(result)
-                                    
-                                print(f"DEBUG: Final iteration result: {iteration_result}")
-                                
-                                # Format the response based on result type
-                                if isinstance(iteration_result, list):
-                                    result_str = f"[{', '.join(iteration_result)}]"
-                                else:
-                                    result_str = str(iteration_result)
-                                
-                                iteration_response.append(
-                                    f"In the {iteration + 1} iteration you called {func_name} with {arguments} parameters, "
-                                    f"and the function returned {result_str}."
-                                )
-                                last_response = iteration_result
-
-                            except Exception as e:
-                                print(f"DEBUG: Error details: {str(e)}")
-                                print(f"DEBUG: Error type: {type(e)}")
-                                import traceback
-                                traceback.print_exc()
-                                iteration_response.append(f"Error in iteration {iteration + 1}: {str(e)}")
-                                break
-
-                        elif response_text.startswith("FINAL_ANSWER:"):
-                            print("\n" + "="*70)
-                            print("✅ QUERY COMPLETE")
-                            print("="*70)
-                            print(f"Final Answer: {response_text}")
-                            print("="*70)
-                            break
-                        
-                        else:
-                            # Neither FUNCTION_CALL nor FINAL_ANSWER was detected
-                            print(f"WARNING: Unexpected response format: {response_text}")
-                            print("Expected FUNCTION_CALL: or FINAL_ANSWER:")
-                            iteration_response.append(f"Iteration {iteration + 1} returned unexpected format")
-
-                        iteration += 1
-                    
-                    # If loop completes without FINAL_ANSWER
-                    if iteration >= max_iterations:
-                        print("\n!!! Maximum iterations reached without FINAL_ANSWER !!!")
-                        print("Iteration history:")
-                        for item in iteration_response:
-                            print(f"  - {item}")
-                    
-                    # End of query processing - loop back to ask for next query
+        elif response_text.startswith("FINAL_ANSWER:"):
+            state.final_answer = response_text
+            print("\n" + "="*70)
+            print("✅ QUERY COMPLETE")
+            print("="*70)
+            print(f"Final Answer: {response_text}")
+            print("="*70)
+            workflow_cache.record(query, state.trace, response_text, state.iteration + 1)
+            journal.append(run_id, "final", answer=response_text)
+            break
+        
+        else:
+            # Neither FUNCTION_CALL nor FINAL_ANSWER was detected
+            print(f"WARNING: Unexpected response format: {response_text}")
+            print("Expected FUNCTION_CALL: or FINAL_ANSWER:")
+            state.iteration_response.append(
+                f"Iteration {state.iteration + 1} returned unexpected format. {guard.unexpected_format()}"
+            )
+
+        state.iteration += 1
+        if guard.should_stop:
+            break
+    
+    # If loop completes without FINAL_ANSWER
+    if state.final_answer is None and guard.should_stop:
+        print(f"\n!!! Stopped early: {guard.stalled} iterations in a row made no progress !!!")
+        print("Iteration history:")
+        for item in state.iteration_response:
+            print(f"  - {item}")
+    elif state.final_answer is None and state.iteration >= guard.budget:
+        print(f"\n!!! Iteration budget ({guard.budget}) reached without FINAL_ANSWER !!!")
+        print("Iteration history:")
+        for item in state.iteration_response:
+            print(f"  - {item}")
+
+    print(f"\n🔁 Iterations: {guard.report(state.iteration)}")
+    emit("report", name="iterations", text=guard.report(state.iteration), wasted=guard.wasted)
+
+    if workflow_cache.lookups:
+        print(f"\n📚 Workflow cache: {workflow_cache.report()}")
+        emit("report", name="workflow_cache", text=workflow_cache.report())
+
+    if any(breaker.failures or breaker.rejected for breaker in breakers.values()):
+        for breaker in breakers.values():
+            print(f"\n⚡ Circuit breaker {breaker.report()}")
+        emit("report", name="circuit_breakers", text="; ".join(b.report() for b in breakers.values()),
+             breakers={name: b.metrics() for name, b in breakers.items()})
+
+    if llm_limiter.throttled or llm_limiter.timeouts:
+        print(f"\n🚦 LLM rate limiter: {llm_limiter.report()}")
+        emit("report", name="rate_limiter", text=llm_limiter.report())
+
+    # Drop any unclaimed speculation and persist what we learned
+    speculator.discard()
+    transition_stats.save()
+    if speculator.launched:
+        print(f"\n🔮 Speculation: {speculator.report()}")
+        emit("report", name="speculation", text=speculator.report())
+
+    # Report background deliveries queued during this query
+    if outbox.deliveries:
+        if outbox.pending:
+            print(f"\n📤 Waiting for {outbox.pending} background deliveries...")
+        await outbox.drain()
+        print("\n📤 Background deliveries:")
+        for line in outbox.report():
+            print(f"  - {line}")
+        emit("report", name="deliveries", lines=outbox.report())
+
+    journal.append(run_id, "end")
+    if journal.enabled:
+        if resume is not None:
+            print(f"\n🧾 Resumed {resume.restored} journaled steps without redoing them")
+        print(f"\n🧾 Journal: {journal.report()}")
+        emit("report", name="journal", text=journal.report())
+
+    emit("final_answer", text=state.final_answer, iterations=state.iteration)
+    return state.final_answer
+
+async def main(resume_run=None):
+    print("Starting main execution...")
+    
+    try:
+        async with AsyncExitStack() as stack:
+            with profiling.labelled("startup"):
+                await start_servers(stack)
+
+            if resume_run is not None:
+                # Finish a crashed run from the journal before taking new queries
+                run_id = latest_unfinished(journal.path) if resume_run == "latest" else resume_run
+                records = load_runs(journal.path).get(run_id) if run_id else None
+                if not records:
+                    print(f"⚠️  No unfinished run {'found' if resume_run == 'latest' else resume_run} in {journal.path}")
+                else:
+                    log = ResumeLog(run_id, records)
+                    print(f"\n🔄 Resuming: {log.query}")
+                    print("-" * 70)
+                    await run_query(log.query, query_id=log.query_id, resume=log)
+
+            # Interactive Query Loop
+            print("\n" + "="*70)
+            print("🤖 AGENTIC AI ASSISTANT - Interactive Mode")
+            print("="*70)
+            print("\nCapabilities:")
+            print("  • Mathematical calculations (ASCII, exponentials, etc.)")
+            print("  • Canvas visualization")
+            print("  • Email results via Gmail")
+            print("\nExamples:")
+            print('  "Calculate ASCII sum for HELLO"')
+            print('  "Calculate ASCII sum for WORLD and visualize it"')
+            print('  "Calculate ASCII sum for AI and email to me@example.com"')
+            print("\nType 'quit', 'exit', or 'q' to stop.\n")
+            print("="*70 + "\n")
+            
+            while True:
+                # Get query from user
+                try:
+                    query = input("\n💬 Your Query: ").strip()
+                except (EOFError, KeyboardInterrupt):
+                    print("\n\n👋 Goodbye!")
+                    break
+                
+                if not query:
+                    print("⚠️  Please enter a query.")
+                    continue
+                
+                if query.lower() in ['quit', 'exit', 'q']:
+                    print("\n👋 Goodbye!")
+                    break
+                
+                print(f"\n🔄 Processing: {query}")
+                print("-" * 70)
+                
+                await run_query(query)
+                
+                # End of query processing - loop back to ask for next query
 
     except Exception as e:
         print(f"\n❌ Error in main execution: {e}")
@@ -406,6 +1022,17 @@ Your entire response should be a single line starting with either FUNCTION_CALL:
         print("="*70)
 
 if __name__ == "__main__":
-    asyncio.run(main())
-    
-    
+    parser = argparse.ArgumentParser(description="Interactive Gemini agent over the Math and Gmail MCP servers")
+    parser.add_argument("--profile", nargs="?", const="sampling", choices=["sampling", "cprofile"],
+                        help="Profile this run (client and math server); output goes to --profile-dir")
+    parser.add_argument("--profile-dir", default=profiling.DEFAULT_DIR)
+    parser.add_argument("--resume", nargs="?", const="latest", metavar="RUN_ID",
+                        help="Resume a crashed run from the journal (default: the latest unfinished one)")
+    args = parser.parse_args()
+    if args.profile:
+        # Exported so the math server we spawn profiles itself too
+        os.environ["MCP_PROFILE"] = args.profile
+        os.environ["MCP_PROFILE_DIR"] = args.profile_dir
+        profiling.start(args.profile, args.profile_dir, "client")
+    profiling.install_toggle_signal("client")
+    asyncio.run(main(args.resume))
@@ -0,0 +1,400 @@
+# -----------------------------
+# worker_pool.py
+# -----------------------------
+# Multi-process scale-out for batches of queries.
+#
+# One talk2mcp.py process uses one core, and its tool calls share one stdio
+# pipe per MCP server. This supervisor starts K worker processes. Each one
+# starts its own warm Math and Gmail servers (talk2mcp.start_servers) and runs
+# up to --per-worker queries at a time.
+#
+# Queries are sharded: each worker has its own inbox, and the supervisor only
+# reads more input when a worker has a free slot. Memory therefore stays
+# bounded however large the input is (backpressure). Results and per-query
+# metrics come back on one shared queue. They are merged into a JSONL results
+# file and a summary.
+#
+# If a worker process dies, its in-flight queries go back to the front of the
+# queue and a replacement worker is started. A query that had already started
+# is resumed from the run journal (run_journal.py) under the run id its worker
+# reported, so side effects such as send-email that already happened are not
+# repeated. Only queries that were running when the worker died are charged an
+# attempt (up to --max-attempts); queries still waiting in its inbox are simply
+# requeued. Workers run their LLM calls in the "batch" rate-limiter lane,
+# and each gets an equal share of LLM_RPM / LLM_TPM.
+#
+# Usage:
+#   python3 worker_pool.py queries.txt --workers 4 --per-worker 2 --out results.jsonl
+#   cat queries.jsonl | python3 worker_pool.py - --workers 8 --save summary.json
+#
+# Input is one query per line, or JSONL objects {"id": ..., "query": ...}.
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from collections import deque, defaultdict
+from dataclasses import dataclass, field
+
+from mcp_loadgen import percentile
+from run_journal import ResumeLog, load_runs
+
+MAX_STARTUP_FAILURES = 3  # consecutive workers dying before they are ready
+
+
+# -----------------------------
+# Worker process
+# -----------------------------
+def worker_main(worker_id, inbox, results, env, log_path):
+    """Entry point of a worker process"""
+    if log_path:
+        log = open(log_path, "a", buffering=1)
+        sys.stdout = sys.stderr = log
+    os.environ.update(env)
+    import asyncio
+    asyncio.run(_worker(worker_id, inbox, results))
+
+
+async def _worker(worker_id, inbox, results):
+    import asyncio
+    from contextlib import AsyncExitStack
+    import talk2mcp
+
+    loop = asyncio.get_running_loop()
+    async with AsyncExitStack() as stack:
+        await talk2mcp.start_servers(stack)
+        results.put(("ready", worker_id, os.getpid()))
+        running = set()
+        while (task := await loop.run_in_executor(None, inbox.get)) is not None:
+            job = asyncio.create_task(_run_one(talk2mcp, worker_id, task, results))
+            running.add(job)
+            job.add_done_callback(running.discard)
+        if running:
+            await asyncio.gather(*running)
+
+
+def _resume_log(journal, run_id):
+    """Journal of a run that a crashed worker left unfinished, if there is one"""
+    if not run_id or not journal.enabled:
+        return None
+    records = load_runs(journal.path).get(run_id)
+    try:
+        return ResumeLog(run_id, records) if records else None
+    except ValueError:
+        return None
+
+
+async def _run_one(talk2mcp, worker_id, task, results):
+    import asyncio
+    query_id, query, resume_run = task
+    metrics = {"reports": {}}
+
+    def emit(event, **data):
+        if event == "start":
+            results.put(("started", worker_id, query_id, data["run_id"]))
+        elif event == "report":
+            metrics["reports"][data["name"]] = data.get("text") or data.get("lines")
+            if data["name"] == "iterations":
+                metrics["wasted"] = data.get("wasted", 0)
+        elif event == "final_answer":
+            metrics["iterations"] = data["iterations"]
+
+    started = time.perf_counter()
+    answer, error = None, None
+    try:
+        resume = await asyncio.to_thread(_resume_log, talk2mcp.journal, resume_run)
+        if resume is not None:
+            print(f"WORKER: resuming [{query_id}] from journaled run {resume_run}")
+        answer = await talk2mcp.run_query(query, emit=emit, query_id=str(query_id),
+                                          priority="batch", resume=resume)
+    except Exception as e:
+        # A failing query is a result, not a crash; it is not retried
+        error = f"{type(e).__name__}: {e}"
+    results.put(("done", worker_id, query_id, {
+        "answer": answer,
+        "error": error,
+        "seconds": time.perf_counter() - started,
+        **metrics,
+    }))
+
+
+# -----------------------------
+# Supervisor
+# -----------------------------
+@dataclass
+class WorkerHandle:
+    slot: int
+    generation: int
+    process: multiprocessing.Process
+    inbox: object
+    ready: bool = False
+    in_flight: dict = field(default_factory=dict)  # query id -> query
+    started: set = field(default_factory=set)      # in-flight query ids that began running
+    completed: int = 0
+
+    @property
+    def worker_id(self):
+        return f"w{self.slot}.{self.generation}"
+
+
+def read_queries(stream):
+    """Yield (id, query) from plain text lines or JSONL objects, lazily"""
+    for number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            entry = json.loads(line)
+            yield str(entry.get("id", number)), entry["query"]
+        else:
+            yield str(number), line
+
+
+class Supervisor:
+    """Runs queries across K worker processes, restarting crashed workers"""
+
+    def __init__(self, workers=os.cpu_count() or 1, per_worker=1, max_attempts=3,
+                 log_dir="worker_logs"):
+        self.num_workers = workers
+        self.per_worker = per_worker
+        self.max_attempts = max_attempts
+        self.log_dir = log_dir
+        self.ctx = multiprocessing.get_context("spawn")
+        self.results = self.ctx.Queue()
+        self.workers: dict[int, WorkerHandle] = {}
+        self.retry = deque()
+        self.attempts = defaultdict(int)  # query id -> runs started
+        self.run_ids = {}  # query id -> journal run id of its latest attempt
+        self.queries = {}  # query id -> query text, while unfinished
+        self.finished = set()
+        self.restarts = 0
+        self.retries = 0
+        self.startup_failures = 0
+        # Each worker gets an equal share of the LLM quota
+        self.worker_env = {
+            "LLM_RPM": str(float(os.getenv("LLM_RPM", "60")) / workers),
+            "LLM_TPM": str(float(os.getenv("LLM_TPM", "1000000")) / workers),
+        }
+
+    def _start_worker(self, slot, generation=0):
+        inbox = self.ctx.Queue()
+        log_path = None
+        if self.log_dir:
+            os.makedirs(self.log_dir, exist_ok=True)
+            log_path = os.path.join(self.log_dir, f"worker-{slot}.log")
+        handle = WorkerHandle(slot, generation, None, inbox)
+        handle.process = self.ctx.Process(
+            target=worker_main, name=f"mcp-worker-{slot}",
+            args=(handle.worker_id, inbox, self.results, self.worker_env, log_path),
+            daemon=True,
+        )
+        handle.process.start()
+        self.workers[slot] = handle
+        print(f"POOL: started worker {handle.worker_id} (pid {handle.process.pid})")
+
+    def _handle_by_id(self, worker_id):
+        for handle in self.workers.values():
+            if handle.worker_id == worker_id:
+                return handle
+        return None
+
+    def _dispatch(self, pending):
+        """Fill free worker slots; returns False once the input is exhausted"""
+        for handle in self.workers.values():
+            while handle.ready and len(handle.in_flight) < self.per_worker:
+                if self.retry:
+                    query_id = self.retry.popleft()
+                    query = self.queries[query_id]
+                else:
+                    try:
+                        query_id, query = next(pending)
+                    except StopIteration:
+                        return False
+                    self.queries[query_id] = query
+                handle.in_flight[query_id] = query
+                handle.inbox.put((query_id, query, self.run_ids.get(query_id)))
+        return True
+
+    def _record(self, out, query_id, worker_id, result):
+        if query_id in self.finished:
+            return  # a retried query finished twice; first result wins
+        self.finished.add(query_id)
+        if query_id in self.retry:
+            self.retry.remove(query_id)
+        record = {
+            "id": query_id,
+            "query": self.queries.pop(query_id),
+            "run_id": self.run_ids.pop(query_id, None),
+            "worker": worker_id,
+            "attempts": self.attempts[query_id],
+            **result,
+        }
+        self.records.append(record)
+        if out is not None:
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+        status = "✅" if record.get("answer") is not None else "❌"
+        print(f"POOL: {status} [{query_id}] {worker_id} {record['seconds']:.2f}s -> "
+              f"{record.get('answer') or record.get('error')}")
+
+    def _on_message(self, message, out):
+        kind, worker_id = message[0], message[1]
+        handle = self._handle_by_id(worker_id)
+        if kind == "ready":
+            if handle is not None:
+                handle.ready = True
+                self.startup_failures = 0
+            return
+        if kind == "started":
+            _, _, query_id, run_id = message
+            self.run_ids[query_id] = run_id
+            self.attempts[query_id] += 1
+            if handle is not None:
+                handle.started.add(query_id)
+            return
+        _, _, query_id, result = message
+        if handle is not None:
+            handle.in_flight.pop(query_id, None)
+            handle.started.discard(query_id)
+            handle.completed += 1
+        else:
+            # Late result from a replaced worker: the query may be running
+            # again elsewhere; drop that copy's bookkeeping once it reports
+            for other in self.workers.values():
+                other.in_flight.pop(query_id, None)
+        self._record(out, query_id, worker_id, result)
+
+    def _check_workers(self, out):
+        for slot, handle in list(self.workers.items()):
+            if handle.process.is_alive():
+                continue
+            print(f"POOL: ⚠️  worker {handle.worker_id} exited with code {handle.process.exitcode}"
+                  f" ({len(handle.in_flight)} queries in flight)")
+            if not handle.ready:
+                self.startup_failures += 1
+                if self.startup_failures >= MAX_STARTUP_FAILURES:
+                    raise RuntimeError(f"{MAX_STARTUP_FAILURES} workers died during startup; "
+                                       f"see {self.log_dir or 'worker output'}")
+            # Retry its in-flight queries first, in their original order. Queries
+            # that never started there (still in its inbox) aren't charged.
+            for query_id in reversed(list(handle.in_flight)):
+                if query_id in self.finished:
+                    continue
+                if query_id not in handle.started:
+                    self.retry.appendleft(query_id)
+                elif self.attempts[query_id] >= self.max_attempts:
+                    self._record(out, query_id, handle.worker_id, {
+                        "answer": None,
+                        "error": f"worker crashed on all {self.attempts[query_id]} attempts",
+                        "seconds": 0.0,
+                    })
+                else:
+                    self.retry.appendleft(query_id)
+                    self.retries += 1
+            self.restarts += 1
+            self._start_worker(slot, handle.generation + 1)
+
+    def run(self, pending, out=None) -> dict:
+        """Run every (id, query) from `pending`; returns the merged summary"""
+        self.records = []
+        started = time.perf_counter()
+        for slot in range(self.num_workers):
+            self._start_worker(slot)
+        has_input = True
+        try:
+            while True:
+                if has_input or self.retry:
+                    has_input = self._dispatch(pending) and has_input
+                busy = any(handle.in_flight for handle in self.workers.values())
+                if not has_input and not self.retry and not busy:
+                    break
+                try:
+                    self._on_message(self.results.get(timeout=0.5), out)
+                    # Drain whatever else arrived before looking for crashes
+                    while True:
+                        self._on_message(self.results.get_nowait(), out)
+                except queue.Empty:
+                    pass
+                self._check_workers(out)
+        finally:
+            self.shutdown()
+        return self.summary(time.perf_counter() - started)
+
+    def shutdown(self, timeout=10.0):
+        for handle in self.workers.values():
+            if handle.process.is_alive():
+                handle.inbox.put(None)
+        deadline = time.monotonic() + timeout
+        for handle in self.workers.values():
+            handle.process.join(max(0.0, deadline - time.monotonic()))
+            if handle.process.is_alive():
+                handle.process.terminate()
+
+    def summary(self, elapsed) -> dict:
+        latencies = sorted(r["seconds"] for r in self.records if r.get("answer") is not None)
+        per_worker = defaultdict(int)
+        for record in self.records:
+            per_worker[record["worker"].split(".")[0]] += 1
+        return {
+            "queries": len(self.records),
+            "answered": len(latencies),
+            "failed": len(self.records) - len(latencies),
+            "workers": self.num_workers,
+            "per_worker_concurrency": self.per_worker,
+            "elapsed_s": elapsed,
+            "throughput_qps": len(self.records) / elapsed if elapsed else 0.0,
+            "p50_s": percentile(latencies, 50),
+            "p90_s": percentile(latencies, 90),
+            "p99_s": percentile(latencies, 99),
+            "iterations": sum(r.get("iterations", 0) for r in self.records),
+            "wasted_iterations": sum(r.get("wasted", 0) for r in self.records),
+            "restarts": self.restarts,
+            "retries": self.retries,
+            "completed_per_worker": dict(sorted(per_worker.items())),
+        }
+
+
+def print_summary(summary):
+    print("\n" + "=" * 70)
+    print(f"Queries: {summary['queries']}  Answered: {summary['answered']}  "
+          f"Failed: {summary['failed']}  Elapsed: {summary['elapsed_s']:.2f}s")
+    print(f"Workers: {summary['workers']} x {summary['per_worker_concurrency']}  "
+          f"Throughput: {summary['throughput_qps']:.2f} queries/s")
+    print(f"Latency p50 {summary['p50_s']:.2f}s  p90 {summary['p90_s']:.2f}s  p99 {summary['p99_s']:.2f}s")
+    print(f"Iterations: {summary['iterations']} ({summary['wasted_iterations']} wasted)  "
+          f"Restarts: {summary['restarts']}  Retried queries: {summary['retries']}")
+    print("-" * 70)
+    for worker, count in summary["completed_per_worker"].items():
+        print(f"  {worker:<10} {count:>6} queries")
+    print("=" * 70)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a batch of queries across worker processes")
+    parser.add_argument("queries", help="File with one query per line or JSONL ('-' for stdin)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument("--per-worker", type=int, default=1, help="Concurrent queries per worker")
+    parser.add_argument("--max-attempts", type=int, default=3,
+                        help="Attempts per query when workers crash")
+    parser.add_argument("--out", default="results.jsonl", help="JSONL file for per-query results")
+    parser.add_argument("--save", help="Write the merged summary to this JSON file")
+    parser.add_argument("--log-dir", default="worker_logs",
+                        help="Directory for worker output ('' = inherit stdout)")
+    args = parser.parse_args()
+
+    stream = sys.stdin if args.queries == "-" else open(args.queries)
+    supervisor = Supervisor(args.workers, args.per_worker, args.max_attempts, args.log_dir)
+    with stream, open(args.out, "w") as out:
+        summary = supervisor.run(read_queries(stream), out)
+    print_summary(summary)
+    print(f"Results written to {args.out}")
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"Saved summary to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+# -----------------------------
+# workflow_cache.py
+# -----------------------------
+# Parameterized trace cache for learned workflows.
+#
+# Many queries are templates ("Calculate ASCII sum for X and email to Y") that
+# pay for several Gemini round trips to rediscover the same tool sequence.
+# Successful traces from the agent loop are generalized into a template with
+# slots taken from the query, and later queries matching a template are
+# replayed directly against the MCP sessions. A step failure, or no template
+# with enough support, falls back to the LLM.
+#
+# Slot candidates are the "data-looking" parts of a query: quoted strings,
+# email addresses, numbers and ALL-CAPS words. A candidate only becomes a slot
+# if its value actually shows up in the tool arguments of the trace.
+import hashlib
+import json
+import os
+import re
+from typing import Any, Awaitable, Callable, Optional
+
+from speculation import result_value, returns_list
+
+CACHE_PATH = os.getenv("MCP_WORKFLOW_CACHE_PATH", "workflow_cache.json")
+
+_CANDIDATE_RE = re.compile(
+    r"'(?P<squote>[^']+)'"
+    r'|"(?P<dquote>[^"]+)"'
+    r"|(?P<email>[\w.+-]+@[\w-]+\.[\w.-]+)"
+    r"|(?P<number>(?<![\w.])-?\d+(?:\.\d+)?(?![\w.]))"
+    r"|(?P<word>\b[A-Z][A-Z0-9]+\b)"
+)
+
+_SLOT_PATTERNS = {
+    "squote": r"[^']+",
+    "dquote": r'[^"]+',
+    "email": r"[\w.+-]+@[\w-]+\.[\w.-]+",
+    "number": r"-?\d+(?:\.\d+)?",
+    "word": r"[A-Za-z0-9]+",
+}
+
+# A float left over as a literal almost certainly came from an earlier result
+# the LLM reformatted; replaying it would repeat a stale number
+_STALE_FLOAT_RE = re.compile(r"\d+\.\d+|\d+e[+-]?\d+", re.IGNORECASE)
+
+
+def _fixed_regex(text: str) -> str:
+    """Regex for the fixed text between slots, tolerant of whitespace changes"""
+    return re.escape(re.sub(r"\s+", " ", text)).replace(r"\ ", r"\s+")
+
+
+def _standalone(value: str) -> str:
+    """Regex matching `value` only where it isn't part of a longer word"""
+    return rf"(?<!\w){re.escape(value)}(?!\w)"
+
+
+class NotGeneralizable(Exception):
+    """Raised when a trace can't be turned into a safe template"""
+
+
+def tool_fingerprint(tool) -> str:
+    """Hash of a tool's name and input schema, used to invalidate templates"""
+    payload = json.dumps({"name": tool.name, "schema": tool.inputSchema}, sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()[:16]
+
+
+def result_text(iteration_result) -> str:
+    if isinstance(iteration_result, str):
+        return iteration_result
+    # Lists of text items, or decoded packed arrays
+    return ", ".join(str(item) for item in iteration_result)
+
+
+def _query_slots(query: str, trace: list[dict]) -> list[tuple[int, int, str, str]]:
+    """Find (start, end, kind, value) spans of the query that feed tool arguments"""
+    used_strings = []
+    used_values = []
+    for step in trace:
+        for value in step["arguments"].values():
+            if isinstance(value, str):
+                used_strings.append(value)
+            else:
+                used_values.append(value)
+
+    spans = []
+    for m in _CANDIDATE_RE.finditer(query):
+        kind = m.lastgroup
+        value = m.group(kind)
+        start, end = m.span(kind)
+        appears = any(re.search(_standalone(value), s) for s in used_strings)
+        if kind == "number":
+            number = float(value)
+            appears = appears or any(v == number for v in used_values if isinstance(v, (int, float)))
+        if appears:
+            spans.append((start, end, kind, value))
+    return spans
+
+
+def _generalize_value(value: Any, slots: dict[str, int], results: list[tuple[Any, str]]):
+    """Express one argument value in terms of slots and earlier step results"""
+    for k, (prev_value, _) in enumerate(results):
+        if prev_value is not None and value == prev_value:
+            return {"ref": k}
+
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        for slot_value, index in slots.items():
+            try:
+                if float(slot_value) == value:
+                    return {"slot": index, "type": type(value).__name__}
+            except ValueError:
+                continue
+        return {"literal": value}
+
+    if not isinstance(value, str):
+        return {"literal": value}
+
+    substitutions = {v: f"{{slot{i}}}" for v, i in slots.items()}
+    for k, (_, text) in enumerate(results):
+        if text and len(text) >= 2:
+            substitutions.setdefault(text, f"{{step{k}}}")
+    if not substitutions:
+        parts = [value]
+    else:
+        alternation = "|".join(_standalone(v) for v in sorted(substitutions, key=len, reverse=True))
+        parts = re.split(f"({alternation})", value)
+
+    fmt = []
+    literal_text = []
+    for part in parts:
+        if part in substitutions:
+            fmt.append(substitutions[part])
+        else:
+            fmt.append(part.replace("{", "{{").replace("}", "}}"))
+            literal_text.append(part)
+    if _STALE_FLOAT_RE.search("".join(literal_text)):
+        raise NotGeneralizable(f"literal number in {value!r} can't be traced to the query or a result")
+
+    fmt = "".join(fmt)
+    if fmt == value.replace("{", "{{").replace("}", "}}"):
+        return {"literal": value}
+    return {"format": fmt}
+
+
+def _bind(spec: dict, slots: list[str], results: list[tuple[Any, str]]):
+    if "literal" in spec:
+        return spec["literal"]
+    if "ref" in spec:
+        return results[spec["ref"]][0]
+    if "slot" in spec:
+        return int(slots[spec["slot"]]) if spec["type"] == "int" else float(slots[spec["slot"]])
+    names = {f"slot{i}": v for i, v in enumerate(slots)}
+    names.update({f"step{k}": text for k, (_, text) in enumerate(results)})
+    return spec["format"].format(**names)
+
+
+def _template_key(template: dict) -> str:
+    return json.dumps([template["pattern"], template["steps"]], sort_keys=True)
+
+
+class WorkflowCache:
+    """Learns tool-call templates from successful traces and replays them"""
+
+    def __init__(self, path: Optional[str] = CACHE_PATH, min_support: int = 2):
+        self.path = path
+        self.min_support = min_support
+        self.templates: list[dict] = []
+        self.fingerprints: dict[str, str] = {}
+        self.list_tools: set[str] = set()  # tools whose results are lists, even of one item
+        self._saved: dict[str, int] = {}  # template key -> support as of the last load/save
+        self.lookups = 0
+        self.hits = 0
+        self.fallbacks = 0
+        self.invalidated = 0
+        self.llm_calls_saved = 0
+        self.load()
+
+    # ---- persistence -------------------------------------------------
+
+    def _read(self) -> list[dict]:
+        if not self.path or not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"DEBUG: Ignoring unreadable workflow cache {self.path}: {e}")
+            return []
+
+    def load(self):
+        self._adopt(self._read())
+
+    def _adopt(self, templates: list[dict]):
+        self.templates = templates
+        self._saved = {_template_key(t): t["support"] for t in templates}
+
+    def save(self):
+        if not self.path:
+            return
+        import fcntl
+        # Worker processes share the file: under a lock, merge this process's
+        # new templates and support into what is on disk now
+        with open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            merged = self._read()
+            on_disk = {_template_key(t): t for t in merged}
+            for template in self.templates:
+                key = _template_key(template)
+                existing = on_disk.get(key)
+                if existing is None:
+                    merged.append(template)
+                else:
+                    existing["support"] += template["support"] - self._saved.get(key, 0)
+                    existing["llm_calls"] = template["llm_calls"]
+            if self.fingerprints:
+                merged = [t for t in merged if self._current(t)]
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(merged, f, indent=1)
+            os.replace(tmp_path, self.path)
+        self._adopt(merged)
+
+    def _current(self, template: dict) -> bool:
+        """Whether the template was built on the current tool schemas"""
+        return all(self.fingerprints.get(name) == fp for name, fp in template["fingerprints"].items())
+
+    def set_tools(self, tools):
+        """Record current tool schemas and drop templates built on old ones"""
+        self.fingerprints = {tool.name: tool_fingerprint(tool) for tool in tools}
+        self.list_tools = {tool.name for tool in tools if returns_list(tool)}
+        kept = [template for template in self.templates if self._current(template)]
+        self.invalidated += len(self.templates) - len(kept)
+        if len(kept) != len(self.templates):
+            print(f"DEBUG: Invalidated {len(self.templates) - len(kept)} workflow templates after tool schema changes")
+            self.templates = kept
+            self.save()
+
+    # ---- recording ---------------------------------------------------
+
+    def record(self, query: str, trace: list[dict], final_answer: str, llm_calls: int):
+        """Generalize a successful trace into a template.
+
+        `trace` is a list of {"tool", "arguments", "result"} dicts in call
+        order, where "result" is the loop's iteration_result (None for queued
+        side effects).
+        """
+        if not trace:
+            return
+        try:
+            template = self._generalize(query, trace, final_answer)
+        except NotGeneralizable as e:
+            print(f"DEBUG: Not caching workflow: {e}")
+            return
+        template["llm_calls"] = llm_calls
+
+        for existing in self.templates:
+            if existing["pattern"] == template["pattern"] and existing["steps"] == template["steps"]:
+                existing["support"] += 1
+                existing["llm_calls"] = llm_calls
+                break
+        else:
+            template["support"] = 1
+            self.templates.append(template)
+        self.save()
+
+    def _generalize(self, query: str, trace: list[dict], final_answer: str) -> dict:
+        spans = _query_slots(query, trace)
+        slots: dict[str, int] = {}
+        kinds = []
+        pattern_parts = []
+        regex_parts = []
+        pos = 0
+        for start, end, kind, value in spans:
+            fixed = query[pos:start]
+            pattern_parts.append(fixed)
+            regex_parts.append(_fixed_regex(fixed))
+            if value in slots:
+                index = slots[value]
+                regex_parts.append(f"(?P=s{index})")
+            else:
+                index = slots[value] = len(slots)
+                kinds.append(kind)
+                regex_parts.append(f"(?P<s{index}>{_SLOT_PATTERNS[kind]})")
+            pattern_parts.append(f"{{slot{index}}}")
+            pos = end
+        fixed = query[pos:]
+        pattern_parts.append(fixed)
+        regex_parts.append(_fixed_regex(fixed))
+
+        results: list[tuple[Any, str]] = []
+        steps = []
+        for step in trace:
+            arguments = {
+                name: _generalize_value(value, slots, results)
+                for name, value in step["arguments"].items()
+            }
+            steps.append({"tool": step["tool"], "arguments": arguments})
+            if step["result"] is None:
+                results.append((None, ""))
+            else:
+                value = result_value(step["result"], step["tool"] in self.list_tools)
+                results.append((value, result_text(step["result"])))
+
+        try:
+            final = _generalize_value(final_answer, slots, results)
+        except NotGeneralizable:
+            # Fall back to the last real result rather than a stale literal
+            last = max((k for k, (v, _) in enumerate(results) if v is not None), default=None)
+            if last is None:
+                raise
+            final = {"format": f"[{{step{last}}}]"}
+
+        return {
+            "pattern": " ".join("".join(pattern_parts).lower().split()),
+            "regex": r"\s*" + "".join(regex_parts) + r"\s*",
+            "slot_kinds": kinds,
+            "steps": steps,
+            "final": final,
+            "fingerprints": {step["tool"]: self.fingerprints.get(step["tool"], "") for step in trace},
+        }
+
+    # ---- replay ------------------------------------------------------
+
+    def match(self, query: str) -> Optional[tuple[dict, list[str]]]:
+        """Best confidently-supported template for a query, with its slot values"""
+        best = None
+        for template in self.templates:
+            if template["support"] < self.min_support:
+                continue
+            m = re.fullmatch(template["regex"], query, re.IGNORECASE)
+            if not m:
+                continue
+            if best is None or template["support"] > best[0]["support"]:
+                slots = [m.group(f"s{i}") for i in range(len(template["slot_kinds"]))]
+                best = (template, slots)
+        return best
+
+    async def replay(self, query: str,
+                     execute: Callable[[str, dict], Awaitable[Any]]) -> Optional[dict]:
+        """Replay a matching template.
+
+        Returns None when nothing matches. Otherwise returns a dict with
+        "completed" (list of executed steps) and either "final_answer" on
+        success or "error" when a step failed and the LLM has to take over.
+        """
+        self.lookups += 1
+        found = self.match(query)
+        if found is None:
+            return None
+        template, slots = found
+        print(f"DEBUG: Replaying cached workflow '{template['pattern']}' with slots {slots}")
+
+        results: list[tuple[Any, str]] = []
+        completed = []
+        for step in template["steps"]:
+            try:
+                arguments = {name: _bind(spec, slots, results)
+                             for name, spec in step["arguments"].items()}
+                iteration_result = await execute(step["tool"], arguments)
+            except Exception as e:
+                self.fallbacks += 1
+                return {"completed": completed, "error": f"{step['tool']} failed during replay: {e}"}
+            completed.append({"tool": step["tool"], "arguments": arguments, "result": iteration_result})
+            if iteration_result is None:
+                results.append((None, ""))
+            else:
+                value = result_value(iteration_result, step["tool"] in self.list_tools)
+                results.append((value, result_text(iteration_result)))
+
+        self.hits += 1
+        self.llm_calls_saved += template.get("llm_calls", len(template["steps"]) + 1)
+        return {"completed": completed, "final_answer": _bind(template["final"], slots, results)}
+
+    def report(self) -> str:
+        hit_rate = self.hits / self.lookups if self.lookups else 0.0
+        return (f"{self.hits}/{self.lookups} replayed ({hit_rate:.0%}), {self.fallbacks} fell back to LLM, "
+                f"{self.llm_calls_saved} LLM calls saved, {len(self.templates)} templates, "
+                f"{self.invalidated} invalidated")